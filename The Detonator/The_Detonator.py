@@ -14,67 +14,475 @@ TO DO:
 
 import pygame
 import sys
-from os import listdir
-from math import atan2, sqrt, cos, sin
-from collections import defaultdict
+import json
+import random
+import struct
+import hashlib
+import marshal
+import threading
+from os import listdir, makedirs, stat
+from time import perf_counter, strftime
+from math import atan2, sqrt, cos, sin, ceil
+from collections import defaultdict, OrderedDict, deque
+from itertools import count, islice
+from operator import attrgetter
+from heapq import heapify, heappush, heappop
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # only used to speed up large batches, everything works without it
 
 # setup
-sys.stdout = sys.stderr # allows printing to output before script finishes
-pygame.init()
-scaled_window = pygame.display.set_mode((800,450), pygame.RESIZABLE)
-window = pygame.Surface((1920,1080))
+FPS = 60 # cap on frames drawn per second (ignored when VSYNC is on)
+PHYSICS_RATE = 60 # physics steps per second, gravity, bomb timers and fading all count these
+VSYNC = False
+INTERPOLATE = False # draw moving objects between their last two physics positions
+RECORD_REPLAYS = False # save the inputs of every attempt at a level to the replays folder
+WATCH_LEVELS = False # for making levels, reload the level being played whenever its file is saved, see TileMap.reload()
+PROFILE = False # start with the profiler on, F3 turns it on and off in game, see Profiler
+VIEW_SIZE = (1920,1080) # size of the window everything is drawn on before scaling
+CHUNK_SIZE = 16 # levels are loaded in square chunks of this many tiles, see TileMap.stream()
+SCALING = "smooth" # how frames get onto the real window: "smooth", "nearest", "letterbox", "integer" or "gpu", see OutputScaler
 SF = 1
-pygame.display.set_caption("The Detonator")
-clock = pygame.time.Clock()
-FPS = 60
-button_font = pygame.font.Font(f'data/font/{listdir("data/font")[0]}', 90)
-title_font = pygame.font.Font(f'data/font/{listdir("data/font")[0]}', 180)
+
+def setup_window():
+    global scaled_window, window, clock, button_font, title_font
+    pygame.init()
+    if SCALING == "gpu":
+        # the window is drawn on directly and SDL scales it to the screen on the graphics card
+        scaled_window = window = pygame.display.set_mode(VIEW_SIZE, pygame.RESIZABLE | pygame.SCALED, vsync=int(VSYNC))
+    else:
+        if VSYNC: scaled_window = pygame.display.set_mode((800,450), pygame.RESIZABLE | pygame.SCALED, vsync=1) # vsync needs SCALED
+        else: scaled_window = pygame.display.set_mode((800,450), pygame.RESIZABLE)
+        window = pygame.Surface(VIEW_SIZE)
+    pygame.display.set_caption("The Detonator")
+    clock = pygame.time.Clock()
+    button_font = pygame.font.Font(f'data/font/{listdir("data/font")[0]}', 90)
+    title_font = pygame.font.Font(f'data/font/{listdir("data/font")[0]}', 180)
+
+# frame pacing
+class FrameScheduler:
+    # runs physics at a fixed rate using an accumulator, no matter how fast frames are drawn
+    def __init__(self, physics_rate, render_cap):
+        self.physics_step = 1 / physics_rate
+        self.render_cap = render_cap
+        self.reset()
+
+    def reset(self):
+        # forget time that passed without physics running (loading, pausing, menus)
+        self.last_time = perf_counter()
+        self.accumulator = 0
+
+    def physics_steps(self) -> int:
+        now = perf_counter()
+        self.accumulator += min(now - self.last_time, 0.25) # after a long stall, slow down instead of spiralling
+        self.last_time = now
+
+        steps = int(self.accumulator // self.physics_step)
+        self.accumulator -= steps * self.physics_step
+        return steps
+
+    @property
+    def alpha(self) -> float: # how far between the last two physics steps the current frame is
+        return self.accumulator / self.physics_step
+
+    def wait(self, idle):
+        if idle:
+            # nothing changed this frame, so sleep until something happens instead of redrawing the same image
+            event = pygame.event.wait(1000)
+            if event.type != pygame.NOEVENT: pygame.event.post(event)
+            self.reset()
+
+        clock.tick(0 if VSYNC else self.render_cap)
+
+# output scaling
+class OutputScaler:
+    # puts each finished frame from source onto target, which can be any size
+    # smooth and nearest stretch it over all of target, letterbox keeps its shape using SF, integer only scales by whole
+    # numbers (or halves, thirds...) with nearest so pixels stay sharp, and gpu leaves it to SDL (source is target)
+    def __init__(self, mode, source, target):
+        self.mode = mode
+        self.source = source
+        self.target = target
+        self.resize()
+
+    def resize(self):
+        # works out where frames go on target, call whenever target changes size
+        global SF
+        source_width, source_height = self.source.get_size()
+        target_width, target_height = self.target.get_size()
+        SF = min(target_width / source_width, target_height / source_height)
+
+        if self.mode in ("smooth", "nearest") or self.source is self.target: size = (target_width, target_height)
+        elif self.mode == "letterbox": size = (round(source_width*SF), round(source_height*SF))
+        else:
+            factor = int(SF) if SF >= 1 else 1 / ceil(1 / SF) # rounded down to a whole number, or a whole fraction when shrinking
+            size = (int(source_width*factor), int(source_height*factor))
+
+        self.rect = pygame.Rect((0,0), size)
+        self.rect.center = (target_width // 2, target_height // 2)
+        self.buffer = pygame.Surface(size, 0, self.target) # scaled frame, reused until the next resize
+        if self.rect.size != self.target.get_size(): self.target.fill("black") # bars around the frame
+
+    def present(self):
+        if self.source is self.target: return
+        if self.rect.size == self.source.get_size(): self.target.blit(self.source, self.rect)
+        else:
+            if self.mode in ("smooth", "letterbox"): pygame.transform.smoothscale(self.source, self.rect.size, self.buffer)
+            else: pygame.transform.scale(self.source, self.rect.size, self.buffer)
+            self.target.blit(self.buffer, self.rect)
+
+    def source_pos(self, pos) -> tuple:
+        # turns a position on target (like the mouse) into one on source
+        return int((pos[0] - self.rect.x) * self.source.get_width() / self.rect.width), int((pos[1] - self.rect.y) * self.source.get_height() / self.rect.height)
 
 # music
-background_music = pygame.mixer.Sound('data/sounds/background_music.mp3')
-background_music.set_volume(0.2)
-background_music.play(loops = -1) # loops infinitely
+def start_music():
+    # streamed from the file while it plays instead of being decoded into memory up front
+    pygame.mixer.music.load('data/sounds/background_music.mp3')
+    pygame.mixer.music.set_volume(0.2)
+    pygame.mixer.music.play(loops = -1) # loops infinitely
 
 # read images from files
 def read_image(file_location, opacity):
+    image = pygame.image.load(file_location)
+    if pygame.display.get_surface() is None: return image # headless, there is no pixel format to convert to
+
     if opacity == "opaque":
-        return pygame.image.load(file_location).convert()
+        return image.convert()
     elif opacity == "transparent":
-        return pygame.image.load(file_location).convert_alpha()
-
-images = {}
-for folder in listdir('data/graphics'):
-    try:
-        with open(f'data/graphics/{folder}/reading.txt','r') as f:
-            for i in f.readlines():
-                file_name, opacity = i.split()
-
-                if file_name[-4:] == ".png": 
-                    images[file_name[:-4]] = [read_image(f'data/graphics/{folder}/{file_name}', opacity)]
+        return image.convert_alpha()
+
+class AssetManager:
+    # hands out images and sounds by name, each one is read from disk the first time it is asked for
+    # preload() reads the rest on a background thread, so they are usually ready before anything needs them
+    def __init__(self):
+        self.image_files = {} # maps image names to (file locations of their frames, opacity)
+        self.sound_files = {}
+        self.loaded = {}
+        self.lock = threading.Lock() # so the background thread and the game never read the same file twice
+        self.muted = True # sounds are only played once unmuted, which running headless never does
+
+        # only the reading.txt files and folder listings are read here, nothing gets decoded
+        for folder in listdir('data/graphics'):
+            try:
+                with open(f'data/graphics/{folder}/reading.txt','r') as f:
+                    for i in f.readlines():
+                        file_name, opacity = i.split()
+
+                        if file_name[-4:] == ".png": 
+                            self.image_files[file_name[:-4]] = ([f'data/graphics/{folder}/{file_name}'], opacity)
+                        else:
+                            self.image_files[file_name] = ([f'data/graphics/{folder}/{file_name}/{fr}' for fr in listdir(f'data/graphics/{folder}/{file_name}')], opacity)
+            except FileNotFoundError: pass
+
+        for file in listdir('data/sounds'):
+            if file != "background_music.mp3": self.sound_files[file[:-4]] = f'data/sounds/{file}' # the music is streamed, see start_music()
+
+    def load(self, kind, name):
+        with self.lock:
+            if (kind, name) not in self.loaded:
+                if kind == "image":
+                    file_locations, opacity = self.image_files[name]
+                    self.loaded[(kind, name)] = [read_image(file_location, opacity) for file_location in file_locations]
                 else:
-                    images[file_name] = [read_image(f'data/graphics/{folder}/{file_name}/{fr}', opacity) for fr in listdir(f'data/graphics/{folder}/{file_name}')]
-    except FileNotFoundError: pass
-
-# read sounds from files
-sounds = {}
-for file in listdir('data/sounds'):
-    sounds[file[:-4]] = pygame.mixer.Sound(f'data/sounds/{file}')
+                    self.loaded[(kind, name)] = pygame.mixer.Sound(self.sound_files[name])
+            return self.loaded[(kind, name)]
+
+    def image(self, name) -> list:
+        # every frame of the image
+        return self.load("image", name)
+
+    def sound(self, name):
+        if self.muted or name not in self.sound_files or not pygame.mixer.get_init(): return None
+        return self.load("sound", name)
+
+    def preload(self):
+        def load_all():
+            for name in self.image_files: self.image(name)
+            if not self.muted:
+                for name in self.sound_files: self.sound(name)
+
+        threading.Thread(target=load_all, daemon=True).start()
+
+assets = AssetManager()
+
+SCALED_CACHE_SIZE = 64 # how many scaled image lists are kept between levels, the least recently used go first
+scaled_cache = OrderedDict()
+def scaled_images(img_name, size) -> list:
+    # the frames of image img_name scaled to size, the same surfaces are handed to everything asking for that name and size
+    key = (img_name, tuple(size))
+    if key in scaled_cache: scaled_cache.move_to_end(key)
+    else:
+        scaled_cache[key] = [pygame.transform.scale(i, size) for i in assets.image(img_name)]
+        if len(scaled_cache) > SCALED_CACHE_SIZE: scaled_cache.popitem(last=False)
+    return scaled_cache[key]
+
+# sounds
+SOUND_POOLS = {"ui": 1, "player": 1, "bombs": 6, "other": 1} # channels kept for each category of sound
+SOUNDS = {"button_select": ("ui", 1), "player_teleport": ("player", 1), "bomb_explode": ("bombs", 4), "bomb_blip": ("bombs", 2)} # category and most copies playing at once
+
+class SoundManager:
+    # plays sounds on channels of their own category, so blips from a pile of bombs can't take the channels explosions need
+    # the same sound asked for more than once in a frame is only played once, and when there are no channels left
+    # the one playing furthest from the camera is cut off, unless the new sound is even further away
+    def __init__(self):
+        self.pools = None # category -> its channels, made the first time anything plays
+        self.playing = {} # channel -> (name, distance from the camera) of what it last played
+        self.queued = {} # name -> distance of the nearest time it was asked for this frame
+
+    def play(self, name, pos=None):
+        # pos is where it happened in world space, sounds without one count as being at the camera
+        if assets.muted: return
+        distance = 0 if pos is None else sqrt((pos[0] - camera.view_rect.centerx)**2 + (pos[1] - camera.view_rect.centery)**2)
+        if name not in self.queued or distance < self.queued[name]: self.queued[name] = distance
+
+    def reserve(self):
+        # the pools' channels are reserved so nothing else that plays a sound gets given them
+        total = sum(SOUND_POOLS.values())
+        pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), total))
+        pygame.mixer.set_reserved(total)
+        ids = count()
+        self.pools = {category: [pygame.mixer.Channel(next(ids)) for _ in range(size)] for category, size in SOUND_POOLS.items()}
+
+    def flush(self):
+        # plays everything asked for since the last call, call once a frame
+        if not self.queued: return
+        queued, self.queued = self.queued, {}
+        for name, distance in sorted(queued.items(), key=lambda item: item[1]):
+            sound = assets.sound(name)
+            if sound is None: continue
+            if self.pools is None: self.reserve()
+
+            category, limit = SOUNDS.get(name, ("other", 1))
+            pool = self.pools[category]
+            same = [channel for channel in pool if channel.get_busy() and self.playing[channel][0] == name]
+            if len(same) >= limit: candidates = same
+            else: candidates = [channel for channel in pool if not channel.get_busy()] or pool
+
+            channel = max(candidates, key=lambda channel: self.playing[channel][1] if channel.get_busy() else float("inf"))
+            if channel.get_busy() and self.playing[channel][1] < distance: continue
+            channel.play(sound)
+            self.playing[channel] = (name, distance)
+
+sounds = SoundManager()
 
 # read levels from files
-level_maps = defaultdict(list)
-level_legends = defaultdict(dict)
-level_list = []
-for file in listdir('data/levels'):
-    with open(f'data/levels/{file}') as f:
-        level_name = file[:-4]
-        level_list.append(level_name)
-
+def read_level(file_location):
+    # returns the level matrix (as a list of rows) and the legend mapping its characters to tile names
+    matrix, legend = [], {}
+    with open(file_location) as f:
         while line := f.readline().strip():
-            level_maps[level_name].append(list(line))
+            matrix.append(line)
 
         while line := f.readline().strip():
             key, val = line.split("=")
-            level_legends[level_name][key.strip()] = val.strip()
+            legend[key.strip()] = val.strip()
+
+    return matrix, legend
+
+SPAWNED = ("player", "vortex", "bomb", "crate") # tile names that become objects instead of tiles
+
+def tile_kind(tile_name) -> str:
+    return "left" if tile_name[:4] == "left" else "right" if tile_name[:5] == "right" else "full"
+
+def compile_level(matrix, legend) -> dict:
+    # turns a parsed level into what TileMap needs, so loading it doesn't have to go over every character again
+    spawns = [] # (tile name, column, row) of everything that isn't a plain tile, in the order they appear
+    chunk_tiles, chunk_kinds = defaultdict(list), defaultdict(dict)
+    for y,row in enumerate(matrix):
+        for x,val in enumerate(row):
+            tile_name = legend[val]
+            if tile_name in SPAWNED: spawns.append((tile_name, x, y))
+            elif tile_name != "air":
+                chunk = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+                chunk_tiles[chunk].append((x, y, tile_name))
+                chunk_kinds[chunk][(x, y)] = tile_kind(tile_name)
+
+    return {"matrix": matrix, "legend": legend, "spawns": spawns,
+            "chunks": {chunk: (tiles, merge_tiles(chunk_kinds[chunk])) for chunk, tiles in chunk_tiles.items()}} # tiles and merged colliders of each chunk
+
+def recompile_level(old, matrix, legend) -> tuple:
+    # compile_level() for an edited version of the compiled level old, only the rows and chunks with edits are gone over again
+    # returns (level, chunks whose tiles changed), the chunks are None when the size or legend changed and nothing was kept
+    if legend != old["legend"] or [len(row) for row in matrix] != [len(row) for row in old["matrix"]]:
+        return compile_level(matrix, legend), None
+
+    def is_tile(val): return legend[val] != "air" and legend[val] not in SPAWNED
+    edited = {y for y, (row, old_row) in enumerate(zip(matrix, old["matrix"])) if row != old_row}
+    chunks = {(x // CHUNK_SIZE, y // CHUNK_SIZE) for y in edited for x, (val, old_val) in enumerate(zip(matrix[y], old["matrix"][y]))
+              if val != old_val and (is_tile(val) or is_tile(old_val))}
+
+    level_chunks = dict(old["chunks"])
+    for column, row in chunks:
+        tiles, kinds = [], {}
+        for y in range(row * CHUNK_SIZE, min((row + 1) * CHUNK_SIZE, len(matrix))):
+            for x in range(column * CHUNK_SIZE, min((column + 1) * CHUNK_SIZE, len(matrix[y]))):
+                if not is_tile(matrix[y][x]): continue
+                tiles.append((x, y, legend[matrix[y][x]]))
+                kinds[(x, y)] = tile_kind(legend[matrix[y][x]])
+        if tiles: level_chunks[(column, row)] = (tiles, merge_tiles(kinds))
+        else: level_chunks.pop((column, row), None)
+
+    spawns = [spawn for spawn in old["spawns"] if spawn[2] not in edited]
+    spawns += [(legend[val], x, y) for y in edited for x, val in enumerate(matrix[y]) if legend[val] in SPAWNED]
+    spawns.sort(key=lambda spawn: (spawn[2], spawn[1]))
+    return {"matrix": matrix, "legend": legend, "spawns": spawns, "chunks": level_chunks}, chunks
+
+LEVEL_CACHE_VERSION = 1 # change whenever compile_level() changes what it makes
+
+class LevelRepository:
+    # finds levels by name without opening them, each one is only read the first time it gets played
+    # compiled levels are saved in cache_folder, so later runs skip parsing the text as long as the file hasn't changed
+    def __init__(self, folder, cache_folder):
+        self.cache_folder = cache_folder
+        self.names = [file[:-4] for file in listdir(folder) if file.endswith(".txt")]
+        self.paths = {level_name: f"{folder}/{level_name}.txt" for level_name in self.names}
+        self.compiled = {}
+        self.keys = {} # the cache key of each level from when its file was read, see changed()
+
+    def add(self, level_name, file_location):
+        # for levels that live outside of the level folder
+        if level_name not in self.paths: self.names.append(level_name)
+        self.paths[level_name] = file_location
+        self.compiled.pop(level_name, None)
+
+    def get(self, level_name) -> dict:
+        if level_name not in self.compiled: self.compiled[level_name] = self.load(level_name)
+        return self.compiled[level_name]
+
+    def key(self, level_name) -> tuple:
+        file_stat = stat(self.paths[level_name])
+        return (LEVEL_CACHE_VERSION, CHUNK_SIZE, file_stat.st_mtime_ns, file_stat.st_size)
+
+    def load(self, level_name) -> dict:
+        key = self.keys[level_name] = self.key(level_name)
+        try:
+            with open(f"{self.cache_folder}/{level_name}.lvl", "rb") as f: cached_key, level = marshal.loads(f.read()) # much faster than marshal.load(f)
+            if cached_key == key: return level
+        except (OSError, EOFError, ValueError, TypeError): pass
+
+        level = compile_level(*read_level(self.paths[level_name]))
+        self.save(level_name, key, level)
+        return level
+
+    def save(self, level_name, key, level):
+        try:
+            makedirs(self.cache_folder, exist_ok=True)
+            with open(f"{self.cache_folder}/{level_name}.lvl", "wb") as f: f.write(marshal.dumps((key, level)))
+        except OSError: pass # the cache is only there to save time
+
+    def changed(self, level_name) -> bool:
+        # whether the file was saved since it was last read, only a stat() so it can be checked every frame
+        try: return self.key(level_name) != self.keys.get(level_name)
+        except OSError: return False # some editors delete the file for a moment while saving it
+
+    def reload(self, level_name) -> tuple:
+        # reads a level again after its file changed, returns what recompile_level() does
+        # a file that can't be read raises, and isn't tried again until it is saved again
+        # the cache isn't written, on big levels that takes longer than the rest, so it is compiled again next launch instead
+        # half written files are caught here, before anything of the level being played is touched
+        old = self.get(level_name)
+        self.keys[level_name] = self.key(level_name)
+        matrix, legend = read_level(self.paths[level_name])
+        if not matrix: raise ValueError(f"{level_name} has no rows")
+        if len({len(row) for row in matrix}) != 1: raise ValueError(f"{level_name} has rows of different lengths")
+        if sum(legend[val] == "player" for row in matrix for val in row) != 1: raise ValueError(f"{level_name} needs exactly one player")
+        level, chunks = recompile_level(old, matrix, legend)
+        self.compiled[level_name] = level
+        return level, chunks
+
+levels = LevelRepository("data/levels", "data/level_cache")
+
+# input sources
+class Controls:
+    # the real keyboard and mouse, kept up to date from the events of each frame instead of asking pygame every step
+    def __init__(self):
+        self.keys = set() # held down
+        self.mouse_down = False
+        self.screen_pos = (0,0) # on the window, in VIEW_SIZE coordinates
+        self.mouse_pos = (0,0) # in world space
+
+    def handle(self, event):
+        if event.type == pygame.KEYDOWN: self.keys.add(event.key)
+        elif event.type == pygame.KEYUP: self.keys.discard(event.key)
+        elif event.type == pygame.MOUSEMOTION: self.screen_pos = unscaled_pos(event.pos)
+        elif event.type in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP):
+            self.screen_pos = unscaled_pos(event.pos)
+            if event.button == 1: self.mouse_down = event.type == pygame.MOUSEBUTTONDOWN
+        elif event.type == pygame.WINDOWFOCUSLOST:
+            # whatever gets released while the window isn't focused never arrives as an event
+            self.keys.clear()
+            self.mouse_down = False
+
+    def update(self):
+        self.mouse_pos = (self.screen_pos[0] + camera.view_rect.x, self.screen_pos[1] + camera.view_rect.y)
+
+    def held(self, key) -> bool:
+        return key in self.keys
+
+class ScriptedControls:
+    # plays back a list of frames, each one being (keys held, mouse position in world space or None if not pressed)
+    def __init__(self, frames=()):
+        self.frames = iter(frames)
+        self.keys = frozenset()
+        self.mouse_down = False
+        self.mouse_pos = (0,0)
+
+    def update(self):
+        self.keys, mouse = next(self.frames, (frozenset(), None))
+        self.mouse_down = mouse is not None
+        if self.mouse_down: self.mouse_pos = mouse
+
+    def held(self, key) -> bool:
+        return key in self.keys
+
+# replays
+REPLAY_KEYS = (pygame.K_a, pygame.K_d, pygame.K_SPACE) # the only keys the physics reads
+REPLAY_MAGIC = b"DTR1"
+
+class InputRecorder:
+    # stores one byte of flags per physics step (plus the mouse position when it is held down)
+    def __init__(self, level_name, seed):
+        self.level_name = level_name
+        self.seed = seed
+        self.frames = bytearray()
+        self.length = 0 # in physics steps
+
+    def record(self, controls):
+        flags = sum(1 << i for i, key in enumerate(REPLAY_KEYS) if controls.held(key))
+        if controls.mouse_down: flags |= 1 << len(REPLAY_KEYS)
+        self.frames.append(flags)
+        if controls.mouse_down: self.frames += struct.pack("<ii", *controls.mouse_pos)
+        self.length += 1
+
+    def save(self, path):
+        name = self.level_name.encode()
+        with open(path, "wb") as f:
+            f.write(REPLAY_MAGIC + struct.pack("<IB", self.seed, len(name)) + name + self.frames)
+
+def read_replay(path):
+    # returns (level name, seed, frames) where frames can be given straight to ScriptedControls
+    with open(path, "rb") as f: data = f.read()
+    if data[:4] != REPLAY_MAGIC: raise ValueError(f"{path} is not a replay")
+
+    seed, name_length = struct.unpack_from("<IB", data, 4)
+    i = 9 + name_length
+    level_name = data[9:i].decode()
+
+    frames = []
+    while i < len(data):
+        flags = data[i]
+        i += 1
+        keys = frozenset(key for bit, key in enumerate(REPLAY_KEYS) if flags & (1 << bit))
+        mouse = None
+        if flags & (1 << len(REPLAY_KEYS)):
+            mouse = struct.unpack_from("<ii", data, i)
+            i += 8
+        frames.append((keys, mouse))
+
+    return level_name, seed, frames
 
 # animations class
 class Animation:
@@ -95,6 +503,12 @@ class Animation:
 
         self.counter += 1
 
+    def get_state(self) -> tuple:
+        return self.animation_index, self.counter, self.frame_duration, self.image
+
+    def set_state(self, state):
+        self.animation_index, self.counter, self.frame_duration, self.image = state
+
 # level classes
 class Object(pygame.sprite.Sprite, Animation):
     def __init__(self, pos, dimensions, images, *, centered=False, **kwargs):
@@ -107,6 +521,14 @@ class Object(pygame.sprite.Sprite, Animation):
     def update(self):
         Animation.update(self)
 
+    # snapshots of the parts that change while playing, used by TileMap.snapshot()
+    def get_state(self) -> tuple:
+        return self.rect.topleft, Animation.get_state(self)
+
+    def set_state(self, state):
+        self.rect.topleft, animation_state = state
+        Animation.set_state(self, animation_state)
+
 class Vortex(Object):
     def __init__(self, pos, dimensions, images, **kwargs):
         super().__init__(pos, dimensions, images, **kwargs)
@@ -115,47 +537,83 @@ class Vortex(Object):
         if pygame.sprite.collide_rect(self, tile_map.player.sprite):
             tile_map.player.sprite.in_vortex = True
 
-    def update(self):
-        super().update()
-        self.check_win()
-
 class Entity(Object):
+    can_sleep = True
+    always_active = False # still gets update() called while asleep
+
     def __init__(self, pos, dimensions, images, **kwargs):
         super().__init__(pos, dimensions, images, **kwargs)
         self.dx = 0
         self.dy = 0
         self.standing = False
         self.premoved = False
+        self.sleeping = False
+        self.quiet_frames = 0 # updates in a row where nothing about this entity changed
+        self.on_tile = False # whether its last move left it standing on a tile without touching another entity
+        self.slept_at = 0 # TileMap.steps when it fell asleep, see resting_standing()
+        self.settled = 0 # updates in a row that left it where it was, unlike quiet_frames being pushed doesn't reset it
+        self.pile = None # the sleeping Pile it is part of
 
     def gravity(self):
         if not self.standing:
             self.dy += tile_map.tile_size / 62.5
 
     def movement(self):
+        # entities that get pushed are moved before the one pushing them, this keeps a stack of unfinished moves
+        # instead of recursing, so long rows and tall piles of crates can't hit the recursion limit
+        moves = [self.move()]
+        while moves:
+            pushed = next(moves[-1], None)
+            if pushed is None: moves.pop()
+            else: moves.append(pushed.move())
+
+    def touching_entities(self):
+        # entities overlapping this one, in update order, leaving out the ones further down the current push chain
+        hits = [entity for entity in tile_map.entity_grid.query(self.rect) if entity is not self and entity not in tile_map.pushing]
+        return sorted(hits, key=lambda entity: entity.order)
+
+    def finish_pushing(self):
+        # an entity that pushed something gets moved to the back of the update order
+        tile_map.pushing.discard(self)
+        if self.alive(): self.order = next(tile_map.order_counter)
+
+    def first_tile_hit(self, start, axis, forward):
+        # sweeps the rect from start to where it is now along one axis and returns the nearest tile in the way, or None
+        # tiles behind the edge it started from are left out, so nothing gets snapped through to the far side of one
+        hits = tile_map.collision_grid.query(self.rect.union(start))
+        if axis == "x":
+            if forward: return min((tile for tile in hits if tile.rect.left > start.left), key=lambda tile: tile.rect.left, default=None)
+            return max((tile for tile in hits if tile.rect.right < start.right), key=lambda tile: tile.rect.right, default=None)
+        if forward: return min((tile for tile in hits if tile.rect.top > start.top), key=lambda tile: tile.rect.top, default=None)
+        return max((tile for tile in hits if tile.rect.bottom < start.bottom), key=lambda tile: tile.rect.bottom, default=None)
+
+    def move(self):
+        # yields every entity this one pushes, movement() moves it before carrying on with this one
         old_x, old_y = self.rect.x, self.rect.y
 
-        # check x direction collisions with tiles
+        # check x direction collisions with tiles, the whole path is checked so fast entities can't go through thin tiles
+        start, forward = self.rect.copy(), self.dx > 0 # borders() can zero dx
         self.rect.x += round(self.dx)
         self.borders()
-        for tile in (hit_list := pygame.sprite.spritecollide(self, tile_map.tiles, False)):
-            if self.dx > 0:
+        if tile := self.first_tile_hit(start, "x", forward):
+            # stop at the point of impact
+            if forward:
                 self.rect.right = tile.rect.left
             else:
                 self.rect.left = tile.rect.right
-        
-        if hit_list: self.dx = self.rect.x - old_x
+            self.dx = self.rect.x - old_x
 
         # check x direction collisions with other entities
-        remove_list = []
-        for entity in pygame.sprite.spritecollide(self, tile_map.entities, False):
-            if entity is self: continue
-            tile_map.entities.remove(self)
-            remove_list.append(self)
+        pushed = False
+        for entity in self.touching_entities():
+            tile_map.pushing.add(self)
+            pushed = True
             
             # do movement of entity on the reciever end first
+            entity.wake()
             entity.dx = self.dx
             entity.premoved = True
-            entity.movement()
+            yield entity
 
             # check if still colliding after movement applied
             if pygame.sprite.collide_rect(self, entity):
@@ -165,31 +623,32 @@ class Entity(Object):
                     self.rect.left = entity.rect.right
                 self.dx = self.rect.x - old_x
 
-        for entity in remove_list: tile_map.entities.add(entity)
+        if pushed: self.finish_pushing()
 
         # check y direction collisions
         self.standing = False
+        start = self.rect.copy()
         self.rect.y += round(self.dy)
-        for tile in (hit_list := pygame.sprite.spritecollide(self, tile_map.tiles, False)):
+        if tile := self.first_tile_hit(start, "y", self.dy > 0):
             if self.dy > 0:
                 self.rect.bottom = tile.rect.top
                 self.standing = True
             else:
                 self.rect.top = tile.rect.bottom
-        
-        if hit_list: self.dy = self.rect.y - old_y
+            self.dy = self.rect.y - old_y
+        on_tile = self.standing and not pushed
 
         # check y direction collisions with other entities
-        remove_list = []
-        for entity in pygame.sprite.spritecollide(self, tile_map.entities, False):
-            if entity is self: continue
-            tile_map.entities.remove(self)
-            remove_list.append(self)
+        pushed = False
+        for entity in self.touching_entities():
+            tile_map.pushing.add(self)
+            pushed = True
             
             # do movement of entity on the reciever end first
+            entity.wake()
             entity.dy = self.dy
             entity.premoved = True
-            entity.movement()
+            yield entity
 
             # check if still colliding after movement applied
             if pygame.sprite.collide_rect(self, entity):
@@ -200,11 +659,18 @@ class Entity(Object):
                     self.rect.top = entity.rect.bottom
                 self.dy = self.rect.y - old_y
         
-        for entity in remove_list: tile_map.entities.add(entity)
+        if pushed: self.finish_pushing()
+        self.on_tile = on_tile and not pushed
 
         # friction (gotta work to make this real friction later)
         if self.standing: self.dx = 0
 
+        tile_map.entity_grid.move(self)
+        if self.rect.x != old_x or self.rect.y != old_y:
+            tile_map.wake_above(pygame.Rect(old_x, old_y, self.rect.width, self.rect.height))
+            if tile_map.piles: tile_map.wake_piles_above(self.rect)
+        if tile_map.recorder is not None: tile_map.recorder.moved.append(self)
+
     def borders(self):
         if self.rect.left < 0:
             self.rect.left = 0
@@ -216,13 +682,110 @@ class Entity(Object):
         if self.rect.y > tile_map.total_height + 2500:
             self.kill()
 
+    def kill(self):
+        if self.pile is not None: self.pile.wake()
+        tile_map.entity_grid.remove(self)
+        tile_map.active.discard(self)
+        tile_map.frozen_entities.discard(self)
+        tile_map.fuses.discard(self)
+        tile_map.settling.discard(self)
+        tile_map.wake_above(self.rect)
+        super().kill()
+
+    def sleep(self):
+        # a sleeping entity stays where it is without being simulated, until wake() is called
+        self.sleeping = True
+        self.slept_at = tile_map.steps
+        tile_map.settling.discard(self)
+        if not self.always_active: tile_map.active.discard(self)
+
+    def wake(self):
+        # called when the entity gets caught in a blast, pushed, or loses what it was resting on
+        self.quiet_frames = 0
+        if not self.sleeping: return
+        if self.pile is not None:
+            self.pile.wake()
+            return
+        self.standing = self.resting_standing()
+        self.sleeping = False
+        if self in tile_map.active: return
+        tile_map.active.add(self)
+        tile_map.queue_update(self)
+
     def update(self):
+        if self.sleeping:
+            Animation.update(self)
+            return
+
+        old_pos = self.rect.topleft
         self.gravity()
         if not self.premoved: self.movement()
         self.premoved = False
         super().update()
 
+        # resting entities go between standing and not standing every frame, they fall asleep standing after two quiet updates in a row
+        # only on tiles, anything resting on another entity keeps pushing it down every other frame (which also changes the update order)
+        # so those are handed to TileMap.settling instead, and fall asleep together with the rest of their pile (see PileRecorder)
+        if self.can_sleep and self.alive() and self.rect.topleft == old_pos:
+            self.quiet_frames = 0 if self.dx or self.dy else self.quiet_frames + 1
+            self.settled += 1
+            if self.quiet_frames >= 2 and self.standing and self.on_tile: self.sleep()
+            elif self.settled >= 4 and not self.always_active and self.frame_duration is None: tile_map.settling.add(self)
+        else:
+            self.quiet_frames = 0
+            self.settled = 0
+            tile_map.settling.discard(self)
+
+    def resting_standing(self) -> bool:
+        # what standing would be if it had kept being updated, a sleeping entity would have gone between standing and not
+        # standing on every update it slept through, starting from standing
+        if not self.sleeping: return self.standing
+        updates = tile_map.steps - self.slept_at - 1
+        if tile_map.update_queue is not None and self.order < tile_map.update_position: updates += 1 # had its turn this frame
+        return updates % 2 == 0
+
+    def resting_state(self) -> tuple:
+        # dx, dy and standing as they would be if it had kept being updated
+        if self.pile is not None: return self.pile.state(self)[1:4]
+        return self.dx, self.dy, self.resting_standing()
+
+    def motion_state(self) -> tuple:
+        # the parts of the state a Pile plays back
+        return self.rect.topleft, self.dx, self.dy, self.standing, self.premoved, self.on_tile
+
+    def get_state(self) -> tuple:
+        if self.pile is not None:
+            # saved awake, as if the pile had been simulated all along
+            _, dx, dy, standing, premoved, on_tile = self.pile.state(self)
+            return super().get_state(), dx, dy, standing, premoved, False, 0, on_tile, 0
+        return super().get_state(), self.dx, self.dy, self.standing, self.premoved, self.sleeping, self.quiet_frames, self.on_tile, self.slept_at
+
+    def set_state(self, state):
+        object_state, self.dx, self.dy, self.standing, self.premoved, self.sleeping, self.quiet_frames, self.on_tile, self.slept_at = state
+        self.settled, self.pile = 0, None
+        super().set_state(object_state)
+
+def blast_forces(origin, points, tile_size):
+    # yields (index, force x, force y) for each point within 4 tiles of a blast at origin, weaker the further away it is
+    if numpy is not None and len(points) >= 64:
+        offsets = numpy.array(points) - origin
+        dists = numpy.sqrt(offsets[:,0]**2 + offsets[:,1]**2) / tile_size
+        reached = numpy.flatnonzero((dists <= 4) & (dists != 0)).tolist()
+        dists = dists.tolist()
+    else:
+        dists = [sqrt((origin[0] - x)**2 + (origin[1] - y)**2) / tile_size for x, y in points]
+        reached = [i for i, dist in enumerate(dists) if 0 < dist <= 4]
+
+    for i in reached:
+        # trig stays in the math module so the results match the old per entity code exactly
+        angle = atan2(points[i][1] - origin[1], points[i][0] - origin[0])
+        yield i, 0.51*tile_size*cos(angle) / dists[i], 0.51*tile_size*sin(angle) / dists[i]
+
 class Bomb(Entity):
+    @property
+    def always_active(self) -> bool: # lit bombs count down while asleep (see TileMap.burn_fuses()), unlit ones are only updated when clicked, see TileMap.pick()
+        return self.ignited
+
     def __init__(self, pos, dimensions, images, **kwargs):
         super().__init__(pos, dimensions, images, **kwargs)
         self.image = images[-1]
@@ -230,7 +793,7 @@ class Bomb(Entity):
         self.timer = 180 # 60 fps means this is 3 seconds
         
     def ignition(self):
-        if pygame.mouse.get_pressed()[0] and self.rect.collidepoint(mouse_x + camera.view_rect.x, mouse_y + camera.view_rect.y):
+        if controls.mouse_down and self.rect.collidepoint(controls.mouse_pos):
             self.ignited = True
             self.frame_duration = 60
             self.animation_index = 0
@@ -242,21 +805,19 @@ class Bomb(Entity):
                 self.explode()
                 return
 
-            if self.timer % 60 == 0: sounds["bomb_blip"].play()
+            if self.timer % 60 == 0: sounds.play("bomb_blip", self.rect.center)
 
             self.timer -= 1
             
     def explode(self):
-        sounds["bomb_explode"].play()
+        sounds.play("bomb_explode", self.rect.center)
         self.kill()
-        for entity in tile_map.entities:
-            dist = sqrt((self.rect.centerx - entity.rect.centerx)**2 + (self.rect.centery - entity.rect.centery)**2) / tile_map.tile_size
-            angle = atan2(entity.rect.centery - self.rect.centery, entity.rect.centerx - self.rect.centerx)
-            if dist > 4 or dist == 0: continue
 
-            blast_force_x = 0.51*tile_map.tile_size*cos(angle) / dist
-            blast_force_y = 0.51*tile_map.tile_size*sin(angle) / dist
-            
+        # only entities near the blast are looked at, and all of their forces are worked out in one go
+        entities = tile_map.entity_grid.query_radius(self.rect.center, 4*tile_map.tile_size)
+        for i, blast_force_x, blast_force_y in blast_forces(self.rect.center, [entity.rect.center for entity in entities], tile_map.tile_size):
+            entity = entities[i]
+            entity.wake()
             if (entity.dx < 0 and blast_force_x < 0) or (entity.dx > 0 and blast_force_x > 0): entity.dx += blast_force_x
             else: entity.dx = blast_force_x
 
@@ -269,6 +830,35 @@ class Bomb(Entity):
         if not self.ignited: self.ignition()
         self.countdown()
         if self.timer > 0: super().update()
+        elif self.sleeping: self.slept_at += 1 # sits out this update, see resting_standing()
+
+    def burn(self):
+        # update() while lit and asleep, on the updates its fuse doesn't blip or go off on
+        self.timer -= 1
+        if self.timer > 0: Animation.update(self)
+        else: self.slept_at += 1
+
+    def wake(self):
+        # the countdown in TileMap.fuses is done at the end of the update, so it catches up if its turn has already come up
+        if self in tile_map.fuses:
+            tile_map.fuses.remove(self)
+            if tile_map.update_queue is not None and self.order < tile_map.update_position: self.burn()
+        super().wake()
+
+    def sleep(self):
+        # stays in tile_map.active until the end of the frame (see TileMap.update()), so being woken again later in the
+        # same frame doesn't give it a second turn
+        self.sleeping = True
+        self.slept_at = tile_map.steps
+        tile_map.settling.discard(self)
+        tile_map.resting.append(self)
+
+    def get_state(self) -> tuple:
+        return super().get_state(), self.ignited, self.timer
+
+    def set_state(self, state):
+        entity_state, self.ignited, self.timer = state
+        super().set_state(entity_state)
 
 class Explosion(Object):
     def __init__(self, bomb):
@@ -283,28 +873,37 @@ class Explosion(Object):
         super().update()
         self.countdown()
 
+    def get_state(self) -> tuple:
+        return super().get_state(), self.timer
+
+    def set_state(self, state):
+        object_state, self.timer = state
+        super().set_state(object_state)
+
 class Player(Entity):
+    can_sleep = False
+
     def __init__(self, pos, dimensions, images, **kwargs):
-        super().__init__(pos, dimensions, images, **kwargs)
+        super().__init__(pos, dimensions, [i.copy() for i in images], **kwargs) # own copies, fade() changes their alpha
         self.WALKING_SPEED = dimensions[0] / 10
         self.input_dx = 0
         self.in_vortex = False
         self.opacity = 255
         self.load_new_level = None
+        self.level_complete = False
 
     def player_input(self):
-        keys = pygame.key.get_pressed()
-        if self.standing and keys[pygame.K_SPACE]: self.dy = tile_map.tile_size / -4
+        if self.standing and controls.held(pygame.K_SPACE): self.dy = tile_map.tile_size / -4
         if self.standing: self.input_dx = 0
 
-        if not(keys[pygame.K_a] != keys[pygame.K_d]): # both or none of left/right keys are pressed
+        if not(controls.held(pygame.K_a) != controls.held(pygame.K_d)): # both or none of left/right keys are pressed
             if abs(self.dx) <= self.WALKING_SPEED and self.input_dx != 0: 
                 self.dx = 0
             self.input_dx = 0
             return
         
-        if keys[pygame.K_a]: self.input_dx = -self.WALKING_SPEED
-        elif keys[pygame.K_d]: self.input_dx = self.WALKING_SPEED
+        if controls.held(pygame.K_a): self.input_dx = -self.WALKING_SPEED
+        elif controls.held(pygame.K_d): self.input_dx = self.WALKING_SPEED
         
         if abs(self.dx) <= self.WALKING_SPEED:
             self.dx = self.input_dx
@@ -314,16 +913,13 @@ class Player(Entity):
             self.load_new_level = tile_map.level_name
 
     def fade(self):
-        if self.opacity == 255: sounds["player_teleport"].play()
+        if self.opacity == 255: sounds.play("player_teleport")
         
         self.opacity -= 10
         for i in self.images:
             i.set_alpha(self.opacity)
 
-        if self.opacity <= -300: 
-            next_level_idx = level_list.index(tile_map.level_name) + 1
-            if next_level_idx == len(level_list): mode.set_mode("level_selection")
-            else: self.load_new_level = level_list[next_level_idx]
+        if self.opacity <= -300: self.level_complete = True
 
     def update(self):
         self.player_input() 
@@ -332,6 +928,18 @@ class Player(Entity):
         if self.in_vortex: self.fade()
         else: camera.update(self)
 
+    def get_state(self) -> tuple:
+        return super().get_state(), self.input_dx, self.in_vortex, self.opacity, self.load_new_level, self.level_complete
+
+    def set_state(self, state):
+        opacity = self.opacity
+        entity_state, self.input_dx, self.in_vortex, self.opacity, self.load_new_level, self.level_complete = state
+        super().set_state(entity_state)
+
+        if self.opacity != opacity:
+            for i in self.images:
+                i.set_alpha(self.opacity)
+
 class Camera:
     def __init__(self, pos: tuple, dimensions: tuple, focus: tuple):
         self.view_rect = pygame.Rect(pos, dimensions)
@@ -376,22 +984,238 @@ class Camera:
             self.view_rect.bottom = tile_map.total_height
             self.focus_rect.y = self.view_rect.y + self.rect_displacement[1]
 
+class SpatialGrid:
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list) # maps (column, row) to the objects overlapping that cell
+        self.placed = {} # maps each object to the cells it was inserted into, so it can be moved or removed later
+
+    def cell_range(self, rect):
+        columns = range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1)
+        rows = range(rect.top // self.cell_size, (rect.bottom - 1) // self.cell_size + 1)
+        return columns, rows
+
+    def insert(self, object):
+        columns, rows = self.placed[object] = self.cell_range(object.rect)
+        for row in rows:
+            for column in columns:
+                self.cells[(column, row)].append(object)
+
+    def remove(self, object):
+        if object not in self.placed: return
+        columns, rows = self.placed.pop(object)
+        for row in rows:
+            for column in columns:
+                cell = self.cells[(column, row)]
+                cell.remove(object)
+                if not cell: del self.cells[(column, row)]
+
+    def move(self, object):
+        # call after object.rect changes, does nothing for objects that were removed
+        if object not in self.placed or self.placed[object] == self.cell_range(object.rect): return
+        self.remove(object)
+        self.insert(object)
+
+    def query(self, rect):
+        # returns the objects colliding with rect, in row-major order (same as the order tiles were added in)
+        # objects spanning several cells are only kept once, a dict keeps the order they were first found in
+        columns, rows = self.cell_range(rect)
+        hits = {}
+        for row in rows:
+            for column in columns:
+                for object in self.cells.get((column, row), ()):
+                    if object not in hits and object.rect.colliderect(rect): hits[object] = None
+        return list(hits)
+
+    def query_radius(self, center, radius):
+        # returns the objects that might have their center within radius of center, the caller does the exact check
+        return self.query(pygame.Rect(center[0] - radius - self.cell_size, center[1] - radius - self.cell_size, 2*(radius + self.cell_size) + 1, 2*(radius + self.cell_size) + 1))
+
+def merge_tiles(kinds) -> list:
+    # greedy meshing, kinds maps the (column, row) of every solid tile to "full", "left" or "right"
+    # returns (column, row, width, height) blocks that cover them all with as few rectangles as it can,
+    # the trimmed left and right edge tiles only get merged with the same kind of tile above or below them
+    blocks = []
+    taken = set()
+    for column, row in sorted(kinds, key=lambda cell: (cell[1], cell[0])):
+        if (column, row) in taken: continue
+        kind = kinds[(column, row)]
+
+        width = 1
+        if kind == "full":
+            while kinds.get((column + width, row)) == kind and (column + width, row) not in taken: width += 1
+
+        height = 1
+        while all(kinds.get((c, row + height)) == kind and (c, row + height) not in taken for c in range(column, column + width)): height += 1
+
+        for r in range(row, row + height):
+            for c in range(column, column + width): taken.add((c, r))
+        blocks.append((column, row, width, height))
+
+    return blocks
+
+class Collider:
+    # a solid rectangle made from merged tiles, only used for collisions
+    def __init__(self, rect):
+        self.rect = rect
+
+class PileRecorder:
+    # watches the entities in TileMap.settling for 2*period updates, and finds the piles among them that went through the
+    # same updates over and over, every period updates or less, without anything else touching them, those sleep as a Pile
+    # piles can't sleep the way single entities do since they never stop changing, the entities on top push the ones
+    # under them down every other update and every push moves the pusher to the back of the update order
+    def __init__(self, tile_map, period):
+        self.tile_map = tile_map
+        self.length = 2 * period
+        self.entities = set(tile_map.settling)
+        self.frames = [] # the turns of every update so far
+        self.turns = [] # (entity, entities it moved to the back of the update order, (entity, motion state) of all it moved)
+        self.moved = [] # entities moved during the current turn, see Entity.move()
+        self.repeated = True # whether every pile that nothing else touched repeated itself
+
+    def update(self, entity):
+        # entity.update() for the turn of any entity while recording
+        mark = next(self.tile_map.order_counter) # entities that push during the turn end up after this
+        self.moved = []
+        entity.update()
+        touched = list(dict.fromkeys([entity, *self.moved]))
+        if any(moved in self.entities for moved in touched):
+            bumped = tuple(sorted((moved for moved in touched if moved.order > mark), key=attrgetter("order")))
+            self.turns.append((entity, bumped, tuple((moved, moved.motion_state()) for moved in touched)))
+
+    def end_frame(self) -> list:
+        # returns the piles found after the last update, as (entities, turns of every update in one period of it)
+        self.frames.append(self.turns)
+        self.turns = []
+        if len(self.frames) < self.length: return []
+
+        # entities moved in the same turn are part of the same pile
+        piles = {entity: {entity} for entity in self.entities}
+        spoiled = set() # touched something outside of self.entities
+        for turns in self.frames:
+            for entity, bumped, states in turns:
+                touched = [moved for moved, state in states]
+                if not all(moved in piles for moved in touched):
+                    spoiled.update(moved for moved in touched if moved in piles)
+                    continue
+                for moved in touched:
+                    if piles[moved] is piles[entity]: continue
+                    merged = piles[entity] | piles[moved]
+                    for member in merged: piles[member] = merged
+
+        found = []
+        for pile in {id(pile): pile for pile in piles.values()}.values():
+            if pile & spoiled: continue
+            if any(entity.sleeping or not entity.alive() or entity.always_active or entity not in self.tile_map.active for entity in pile): continue
+            frames = [[turn for turn in turns if turn[0] in pile] for turns in self.frames]
+            if any(len(turns) != len(pile) or {turn[0] for turn in turns} != pile for turns in frames): continue # everyone had one turn
+            # only pushed straight down and always back where they started by the end of a turn, see TileMap.wake_piles_above()
+            if any(state[0] != moved.rect.topleft or state[1] for turns in frames for turn in turns for moved, state in turn[2]): continue
+
+            # the same turns in the same order twice in a row, so from here on it keeps repeating them
+            period = next((period for period in range(1, self.length // 2 + 1) if frames[-2*period:-period] == frames[-period:]), None)
+            if period is None: self.repeated = False
+            else: found.append((pile, frames[-period:]))
+        return found
+
+class Pile:
+    # entities resting on each other that sleep together, they play back the updates PileRecorder saw them repeat
+    # only the pushes that move entities to the back of the update order are still done, with the rest of the updates
+    # (see TileMap.update()), everything else about the entities is worked out when it is needed, see state()
+    # anything that would wake one of them wakes all of them
+    def __init__(self, tile_map, entities, frames):
+        self.tile_map = tile_map
+        self.entities = entities
+        self.start = tile_map.steps + 1 # the first update slept through is frames[0] again
+        self.orders = [] # per frame, the entities in the order of their turns
+        self.events = [] # per frame, maps every entity to (turn, motion state after it) for every turn that changed it
+        self.pushes = [] # per frame, (turn, entities moved to the back of the update order) for every turn that did
+        for turns in frames:
+            self.orders.append([entity for entity, bumped, states in turns])
+            events = defaultdict(list)
+            for turn, (entity, bumped, states) in enumerate(turns):
+                for moved, state in states: events[moved].append((turn, state))
+            self.events.append(events)
+            self.pushes.append([(turn, bumped) for turn, (entity, bumped, states) in enumerate(turns) if bumped])
+        self.ends = [{entity: events[entity][-1][1] for entity in entities} for events in self.events]
+
+        for entity in entities:
+            entity.sleeping, entity.pile = True, self
+            tile_map.active.discard(entity)
+            tile_map.settling.discard(entity)
+        tile_map.piles.add(self)
+
+    def frame(self, steps) -> int:
+        # which of the frames the update numbered steps plays back
+        return (steps - self.start) % len(self.orders)
+
+    def schedule(self):
+        # called at the start of every update, queues the first turn that pushes something
+        # the turns are queued by where the entity taking them was in the update order when the update started
+        frame = self.frame(self.tile_map.steps)
+        self.turn_orders = [self.orders[frame][turn].order for turn, bumped in self.pushes[frame]]
+        self.start_orders = {} # where entities that were already moved back this update were when it started
+        self.next_push = 0
+        if self.turn_orders: heappush(self.tile_map.update_queue, (self.turn_orders[0], self))
+
+    def update(self):
+        # does the pushes of every turn up to the next entity in the update queue, and queues the rest
+        queue, pushes = self.tile_map.update_queue, self.pushes[self.frame(self.tile_map.steps)]
+        while self.next_push < len(pushes) and (not queue or self.turn_orders[self.next_push] < queue[0][0]):
+            for entity in pushes[self.next_push][1]:
+                self.start_orders.setdefault(entity, entity.order)
+                entity.order = next(self.tile_map.order_counter)
+            self.next_push += 1
+        if self.next_push < len(pushes): heappush(queue, (self.turn_orders[self.next_push], self))
+
+    def turns_taken(self) -> int:
+        # how many of the turns of the current update have come up
+        if self.tile_map.update_queue is None: return 0
+        return sum(self.start_orders.get(entity, entity.order) < self.tile_map.update_position for entity in self.orders[self.frame(self.tile_map.steps)])
+
+    def state(self, entity, turns=None) -> tuple:
+        # the motion state entity would have now if the pile had been simulated all along
+        state = self.ends[self.frame(self.tile_map.steps - 1)][entity] # after the last update
+        if self.tile_map.update_queue is None: return state
+        if turns is None: turns = self.turns_taken()
+        for turn, event_state in self.events[self.frame(self.tile_map.steps)][entity]:
+            if turn >= turns: break
+            state = event_state
+        return state
+
+    def wake(self):
+        # carries on simulating all of the entities from where the playback got to, the ones whose turn hasn't come up
+        # yet still get it this update
+        tile_map = self.tile_map
+        tile_map.piles.discard(self)
+        turns = self.turns_taken()
+        if tile_map.update_queue is not None and self.next_push < len(self.turn_orders):
+            tile_map.update_queue.remove((self.turn_orders[self.next_push], self)) # its entities take those turns themselves now
+            heapify(tile_map.update_queue)
+        for entity in self.entities:
+            _, entity.dx, entity.dy, entity.standing, entity.premoved, entity.on_tile = self.state(entity, turns)
+            entity.sleeping, entity.pile, entity.quiet_frames, entity.settled = False, None, 0, 0
+            tile_map.active.add(entity)
+            if tile_map.update_queue is not None:
+                start_order = self.start_orders.get(entity, entity.order)
+                if start_order > tile_map.update_position: heappush(tile_map.update_queue, (start_order, entity))
+
 class TileMap:
     def __init__(self, level_name):
         self.level_name = level_name
         self.paused = False
 
-        self.matrix = level_maps[level_name]
+        self.level = levels.get(level_name)
+        self.matrix = self.level["matrix"]
         #self.tile_size = min(window.get_width() // len(self.matrix[0]),  window.get_height() // len(self.matrix))
         self.tile_size = 60
         self.total_width = len(self.matrix[0]) * self.tile_size
         self.total_height = len(self.matrix) * self.tile_size
-        self.screen = pygame.Surface((self.total_width, self.total_height))
 
-        self.legend = level_legends[level_name]
-        self.resized_images = {img_name: [pygame.transform.scale(i,(self.tile_size,self.tile_size)) for i in images[img_name]] for img_name in self.legend.values() if img_name != "air"}
-        self.resized_images["explosion"] = [pygame.transform.scale(i,(self.tile_size*2,self.tile_size*2)) for i in images["explosion"]]
-        self.resized_images["vortex"] = [pygame.transform.scale(i,(self.tile_size*1.4,self.tile_size*1.4)) for i in images["vortex"]]
+        self.legend = self.level["legend"]
+        self.resized_images = {img_name: scaled_images(img_name, (self.tile_size,self.tile_size)) for img_name in self.legend.values() if img_name != "air"}
+        self.resized_images["explosion"] = scaled_images("explosion", (self.tile_size*2,self.tile_size*2))
+        self.resized_images["vortex"] = scaled_images("vortex", (self.tile_size*1.4,self.tile_size*1.4))
 
         self.tiles = pygame.sprite.Group()
         self.interactables = pygame.sprite.Group()
@@ -400,48 +1224,467 @@ class TileMap:
         self.player = pygame.sprite.GroupSingle()
 
         self.image_allignments = {} # used for objects with: topleft point rect != topleft point image
+        self.previous_positions = {}
+
+        # spatial indexes so collision checks only look at nearby cells instead of every object
+        self.tile_grid = SpatialGrid(self.tile_size) # for drawing
+        self.collision_grid = SpatialGrid(self.tile_size) # merged solid tiles, see merge_tiles()
+        self.interactable_grid = SpatialGrid(self.tile_size)
+        self.entity_grid = SpatialGrid(self.tile_size) # kept up to date as entities move
+        self.pushing = set() # entities partway through pushing others, see Entity.movement()
+        self.order_counter = count() # entities are updated in order of their .order, see in_order()
+        self.active = set() # entities that get updated every frame, the rest are asleep
+        self.update_queue = None # entities still to be updated this frame, see update()
+        self.resting = [] # sleeping entities in self.active until the end of update(), lit bombs go to self.fuses then
+        self.fuses = set() # sleeping lit bombs, counted down all together instead of each taking a turn, see burn_fuses()
+        self.steps = 0 # update() calls so far, sleeping entities count the updates they missed from it
+        self.settling = set() # awake entities that stopped moving but can't sleep on their own, see Entity.update()
+        self.recorder = None # PileRecorder watching self.settling
+        self.next_recording = 0 # steps when self.settling can be recorded again
+        self.pile_period = 2 # longest period the next PileRecorder looks for
+        self.piles = set() # sleeping Piles
+
+        # tiles and colliders only exist for chunks near the camera, everything else stays as characters in self.matrix
+        self.chunk_pixels = CHUNK_SIZE * self.tile_size
+        self.chunks = {} # maps (column, row) of each loaded chunk to its (tiles, colliders)
+        self.active_area = pygame.Rect(0, 0, self.total_width, self.total_height) # entities outside of it are frozen
+        self.freezing = False # whether any of the level is outside self.active_area
+        self.frozen_entities = set() # taken out of self.active until self.active_area reaches them
+        self.streamed_range = None # chunk ranges from the last stream(), nothing changes until they do
+
+        self.spawned = {spawn: self.spawn(*spawn) for spawn in self.level["spawns"]} # the object made for each spawn, see reload()
+        self.start_state = self.snapshot()
+
+    def spawn(self, tile_name, x, y):
+        pos, dimensions = (x * self.tile_size, y * self.tile_size), (self.tile_size, self.tile_size)
+        if tile_name == "vortex":
+            object = Vortex(pos, dimensions, self.resized_images[tile_name], frame_duration = 5)
+            self.interactables.add(object)
+            self.interactable_grid.insert(object)
+            self.image_allignments[object] = (-0.2*self.tile_size, -0.2*self.tile_size)
+            return object
+
+        if tile_name == "player":
+            object = Player(pos, dimensions, self.resized_images[tile_name])
+            self.player.add(object)
+        elif tile_name == "bomb": object = Bomb(pos, dimensions, self.resized_images[tile_name])
+        else: object = Entity(pos, dimensions, self.resized_images[tile_name])
+
+        self.entities.add(object)
+        object.order = next(self.order_counter)
+        self.entity_grid.insert(object)
+        self.active.add(object)
+        return object
+
+    def load_chunk(self, chunk):
+        tiles, solid_tiles = [], {}
+        chunk_tiles, blocks = self.level["chunks"].get(chunk, ((), ()))
+        for x, y, tile_name in chunk_tiles:
+            if tile_name[:4] == "left":
+                object = Object((x*self.tile_size + 0.1*self.tile_size, y * self.tile_size), (0.9*self.tile_size, self.tile_size), self.resized_images[tile_name])
+                self.image_allignments[object] = (-0.1*self.tile_size, 0)
+
+            elif tile_name[:5] == "right":
+                object = Object((x * self.tile_size, y * self.tile_size), (0.9*self.tile_size, self.tile_size), self.resized_images[tile_name])
+
+            else:
+                object = Object((x * self.tile_size, y * self.tile_size), (self.tile_size, self.tile_size), self.resized_images[tile_name])
+
+            self.tiles.add(object)
+            self.tile_grid.insert(object)
+            tiles.append(object)
+            solid_tiles[(x, y)] = object
+
+        # tiles are still drawn one by one, but collisions are checked against them merged into bigger rectangles, see compile_level()
+        colliders = []
+        for column, row, width, height in blocks:
+            first, last = solid_tiles[(column, row)], solid_tiles[(column + width - 1, row + height - 1)]
+            colliders.append(Collider(first.rect.union(last.rect)))
+            self.collision_grid.insert(colliders[-1])
+
+        self.chunks[chunk] = (tiles, colliders)
+
+    def unload_chunk(self, chunk):
+        tiles, colliders = self.chunks.pop(chunk)
+        for tile in tiles:
+            tile.kill()
+            self.tile_grid.remove(tile)
+            self.image_allignments.pop(tile, None)
+        for collider in colliders: self.collision_grid.remove(collider)
+
+    def chunk_range(self, rect):
+        # the columns and rows of the chunks overlapping rect, limited to the ones in the level
+        columns = range(max(rect.left // self.chunk_pixels, 0), min((rect.right - 1) // self.chunk_pixels, (self.total_width - 1) // self.chunk_pixels) + 1)
+        rows = range(max(rect.top // self.chunk_pixels, 0), min((rect.bottom - 1) // self.chunk_pixels, (self.total_height - 1) // self.chunk_pixels) + 1)
+        return columns, rows
+
+    def load_area(self, rect):
+        # makes sure every chunk overlapping rect is loaded
+        columns, rows = self.chunk_range(rect)
+        for row in rows:
+            for column in columns:
+                if (column, row) not in self.chunks: self.load_chunk((column, row))
+
+    def stream(self, view_rect):
+        # loads the chunks around the view and frees the ones that got far enough away,
+        # entities are only simulated one chunk past the view, so everything they can reach is always loaded
+        load_rect = view_rect.inflate(4*self.chunk_pixels, 4*self.chunk_pixels)
+        columns, rows = active_range = self.chunk_range(view_rect.inflate(2*self.chunk_pixels, 2*self.chunk_pixels))
+        if (active_range, self.chunk_range(load_rect)) == self.streamed_range: return
+        self.streamed_range = (active_range, self.chunk_range(load_rect))
+
+        self.active_area = pygame.Rect(columns.start*self.chunk_pixels, rows.start*self.chunk_pixels, len(columns)*self.chunk_pixels, len(rows)*self.chunk_pixels)
+        self.freezing = not self.active_area.contains((0, 0, self.total_width, self.total_height))
+        for entity in [entity for entity in self.frozen_entities if not self.frozen(entity)]:
+            self.frozen_entities.remove(entity)
+            (self.fuses if entity.sleeping and entity.always_active else self.active).add(entity)
+        for bomb in [bomb for bomb in self.fuses if self.frozen(bomb)]: # they don't move, so this is the only time they can freeze
+            self.fuses.remove(bomb)
+            self.frozen_entities.add(bomb)
+        for pile in [pile for pile in self.piles if any(self.frozen(entity) for entity in pile.entities)]: pile.wake() # so they can freeze
+
+        self.load_area(load_rect)
+        columns, rows = self.chunk_range(view_rect.inflate(6*self.chunk_pixels, 6*self.chunk_pixels))
+        for chunk in [chunk for chunk in self.chunks if chunk[0] not in columns or chunk[1] not in rows]: self.unload_chunk(chunk)
+
+    def frozen(self, entity) -> bool:
+        # entities that fell off the level count as being at its edge, so they keep falling while the view is near
+        x = min(max(entity.rect.centerx, 0), self.total_width - 1)
+        y = min(max(entity.rect.centery, 0), self.total_height - 1)
+        return not self.active_area.collidepoint(x, y) and entity is not self.player.sprite
+
+    def in_order(self) -> list:
+        # the entities in update order, self.entities keeps the order they were added in since pushing changes .order all the time
+        return sorted(self.entities, key=attrgetter("order"))
+
+    def snapshot(self) -> tuple:
+        # everything that changes while playing, tiles never change so they are left out
+        return (tuple((entity, entity.get_state()) for entity in self.in_order()),
+                tuple((interactable, interactable.get_state()) for interactable in self.interactables),
+                tuple((visual, visual.get_state()) for visual in self.visuals),
+                self.steps)
+
+    def restore(self, snapshot):
+        # puts the level back the way it was when snapshot() was taken, in place
+        self.steps = snapshot[3]
+        for group, states in zip((self.entities, self.interactables, self.visuals), snapshot):
+            group.empty()
+            for object, state in states:
+                object.set_state(state)
+                group.add(object)
+
+        for entity, state in snapshot[0]:
+            if isinstance(entity, Player): self.player.add(entity)
+
+        self.entity_grid = SpatialGrid(self.tile_size)
+        self.pushing = set()
+        self.active = {entity for entity in self.entities if not entity.sleeping}
+        self.fuses = {entity for entity in self.entities if entity.sleeping and entity.always_active}
+        self.frozen_entities = {bomb for bomb in self.fuses if self.frozen(bomb)} # awake ones freeze on their turn instead
+        self.fuses -= self.frozen_entities
+        self.update_queue = None
+        self.resting = []
+        self.settling, self.recorder, self.next_recording, self.pile_period, self.piles = set(), None, 0, 2, set()
+        for entity in self.entities:
+            entity.order = next(self.order_counter)
+            self.entity_grid.insert(entity)
+        self.previous_positions = {}
+        self.paused = False
+
+    def restart(self):
+        self.restore(self.start_state)
+
+    def reload(self) -> list:
+        # brings the level up to date with its file in place, only the chunks with edited tiles are built again and only
+        # edited spawns are added or removed, the player and everything else carry on as they were (restarting uses the edits)
+        # returns world space rects of the level that look different now, or None if the size or legend changed and
+        # the level has to be built again from scratch
+        level, chunks = levels.reload(self.level_name)
+        if chunks is None: return None
+        self.level, self.matrix = level, level["matrix"]
+
+        areas = []
+        for chunk in chunks:
+            if chunk in self.chunks:
+                self.unload_chunk(chunk)
+                self.load_chunk(chunk)
+            areas.append(pygame.Rect(chunk[0]*self.chunk_pixels, chunk[1]*self.chunk_pixels, self.chunk_pixels, self.chunk_pixels))
+            for entity in self.entity_grid.query(areas[-1].inflate(2, 2)): entity.wake() # in case what they were resting on is gone
+
+        starts = {object: state for group in self.start_state[:3] for object, state in group}
+        player = self.player.sprite
+        spawns = set(level["spawns"])
+        for spawn in [spawn for spawn in self.spawned if spawn not in spawns]:
+            object = self.spawned.pop(spawn)
+            if object is player: continue
+            del starts[object]
+            object.kill()
+            if isinstance(object, Vortex):
+                self.interactable_grid.remove(object)
+                del self.image_allignments[object]
+
+        added = []
+        player_moved = player not in self.spawned.values()
+        for spawn in level["spawns"]:
+            if spawn in self.spawned: continue
+            if spawn[0] == "player" and player_moved:
+                # the player stays where it is, only where it starts from moves
+                state = player.get_state()
+                player.set_state(starts[player])
+                player.rect.topleft = (spawn[1] * self.tile_size, spawn[2] * self.tile_size)
+                starts[player] = player.get_state()
+                player.set_state(state)
+                self.spawned[spawn] = player
+                player_moved = False
+                continue
+            object = self.spawned[spawn] = self.spawn(*spawn)
+            starts[object] = object.get_state()
+            added.append(object)
+
+        start_state = []
+        for group, states in zip((self.entities, self.interactables, self.visuals), self.start_state):
+            objects = [object for object, _ in states if object in starts] + [object for object in added if object in group]
+            start_state.append(tuple((object, starts[object]) for object in objects))
+        self.start_state = (*start_state, self.start_state[3])
+        return areas
+
+    def queue_update(self, entity):
+        # an entity woken partway through update() still gets its turn this frame if it hasn't come up yet
+        if self.update_queue is not None and entity.order > self.update_position:
+            heappush(self.update_queue, (entity.order, entity))
+
+    def pick(self, pos) -> list:
+        # the sleeping entities at pos in world space that react to the mouse, they get updated on frames it is held over them
+        # ones in a Pile wake the whole pile instead, the rest of it can't carry on playing back without them
+        picked = [entity for entity in self.entity_grid.query(pygame.Rect(pos, (1,1))) if isinstance(entity, Bomb) and entity.sleeping and entity not in self.active and entity not in self.fuses]
+        for entity in picked:
+            if entity.pile is not None: entity.wake()
+        return [entity for entity in picked if entity.sleeping]
+
+    def burn_fuses(self):
+        # the turns the bombs in self.fuses sat out this update, they only count down so their order doesn't matter
+        for bomb in self.fuses: bomb.burn()
+
+    def wake_above(self, rect):
+        # wakes the sleeping entities resting on top of rect, for when whatever was there moves away
+        for entity in self.entity_grid.query(pygame.Rect(rect.x, rect.y - 1, rect.width, 1)):
+            if entity.sleeping: entity.wake()
+
+    def wake_piles_above(self, rect):
+        # entities in a pile get pushed down a pixel every other update, so one that moved right under them would have been hit
+        for entity in self.entity_grid.query(pygame.Rect(rect.x, rect.y - 1, rect.width, 1)):
+            if entity.pile is not None: entity.wake()
+
+    def update(self):
+        self.stream(camera.view_rect)
+        if controls.mouse_down: self.resting = self.pick(controls.mouse_pos)
+        # sleeping lit bombs only take a turn of their own on updates their fuse blips or goes off on
+        lit = [bomb for bomb in self.fuses if bomb.timer % 60 == 0]
+        self.fuses.difference_update(lit)
+        self.resting.extend(lit)
+        self.active.update(self.resting)
+
+        # only awake entities are updated, in update order, so the cost follows how much is moving
+        self.update_queue = [(entity.order, entity) for entity in self.active]
+        heapify(self.update_queue)
+        for pile in self.piles: pile.schedule()
+        while self.update_queue:
+            self.update_position, entity = heappop(self.update_queue)
+            if isinstance(entity, Pile): entity.update()
+            elif self.freezing and self.frozen(entity):
+                self.active.discard(entity)
+                self.frozen_entities.add(entity)
+                self.settling.discard(entity)
+            elif self.recorder is not None: self.recorder.update(entity)
+            else: entity.update()
+        self.update_queue = None
+        self.burn_fuses()
+        for entity in self.resting:
+            if entity.sleeping and entity in self.active:
+                self.active.discard(entity)
+                if entity.always_active: self.fuses.add(entity)
+        self.resting = []
+
+        if self.recorder is not None:
+            for pile in self.recorder.end_frame(): Pile(self, *pile)
+            if len(self.recorder.frames) == self.recorder.length:
+                # piles that didn't repeat are given longer to next time, up to 16 updates
+                self.pile_period = 2 if self.recorder.repeated else min(2 * self.pile_period, 16)
+                self.recorder, self.next_recording = None, self.steps + 16
+        elif self.settling and self.steps >= self.next_recording: self.recorder = PileRecorder(self, self.pile_period)
+        self.steps += 1
+
+        self.interactables.update()
+        for interactable in self.interactable_grid.query(self.player.sprite.rect): interactable.check_win()
+        # tiles never change, so they are left out of the update
+        self.visuals.update()
+
+    def save_positions(self):
+        # remembers where entities were before a physics step, so frames can be drawn in between steps
+        self.previous_positions = {entity: entity.rect.topleft for entity in self.entities}
+
+# headless engine
+class Simulation:
+    # runs a level with no window, audio or frame limit, as fast as the CPU allows
+    def __init__(self, level_name, inputs=(), seed=0):
+        random.seed(seed)
+        self.controls = ScriptedControls(inputs)
+        self.tile_map = TileMap(level_name)
+        self.camera = Camera((0,0), VIEW_SIZE, (0.2, 0.3))
+        self.frame = 0
+
+        self.activate()
+        self.camera.update(self.tile_map.player.sprite)
+
+    def activate(self):
+        # the game objects look these up as globals
+        global tile_map, camera, controls
+        tile_map, camera, controls = self.tile_map, self.camera, self.controls
+
+    @property
+    def status(self) -> str:
+        player = self.tile_map.player.sprite
+        if player.in_vortex: return "won"
+        if player.load_new_level or not player.alive(): return "dead"
+        return "playing"
+
+    def snapshot(self) -> tuple:
+        return self.tile_map.snapshot(), self.camera.view_rect.copy(), self.camera.focus_rect.copy(), self.frame
+
+    def restore(self, snapshot):
+        level_snapshot, view_rect, focus_rect, self.frame = snapshot
+        self.tile_map.restore(level_snapshot)
+        self.camera.view_rect, self.camera.focus_rect = view_rect.copy(), focus_rect.copy()
+
+    def state_hash(self) -> str:
+        # the same on every run and machine for the same state, for checking replays frame by frame
+        state = []
+        for entity in self.tile_map.in_order():
+            state.append((type(entity).__name__, tuple(entity.rect), *entity.resting_state(), getattr(entity, "timer", None), getattr(entity, "opacity", None)))
+        for visual in self.tile_map.visuals:
+            state.append((type(visual).__name__, tuple(visual.rect), visual.timer))
+        return hashlib.blake2b(repr(state).encode(), digest_size=8).hexdigest()
+
+    def step(self, n=1) -> str:
+        self.activate()
+        for _ in range(n):
+            if self.status != "playing": break
+            self.controls.update()
+            self.tile_map.update()
+            self.frame += 1
+
+        return self.status
+
+class Renderer:
+    # draws the level straight onto the window in camera space, so nothing level sized is ever allocated
+    def __init__(self, tile_map, background, sun, view_size):
+        self.tile_map = tile_map
+        self.background = background # tiled across the level, one copy per view sized block
+        self.sun = sun
+        self.level_rect = pygame.Rect(0, 0, tile_map.total_width, tile_map.total_height)
+
+        self.static_layer = pygame.Surface(view_size).convert() # background, sun and tiles of the current view
+        self.static_view = None # world space rect currently on self.static_layer
+        self.full_redraw = True
+        self.dirty_rects = [] # regions of the window that need restoring from self.static_layer next frame
+
+    def invalidate(self, rect=None):
+        # marks a region of the window (or all of it) as drawn over by something other than the renderer
+        if rect is None: self.full_redraw = True
+        else: self.dirty_rects.append(pygame.Rect(rect))
+
+    def draw_static(self, area):
+        # draws everything that never moves inside the world space rect area onto self.static_layer
+        offset_x, offset_y = -self.static_view.x, -self.static_view.y
+        self.static_layer.set_clip(area.move(offset_x, offset_y))
+        self.static_layer.fill("black")
+
+        level_area = area.clip(self.level_rect)
+        if level_area.width and level_area.height:
+            width, height = self.background.get_size()
+            for row in range(level_area.top // height, (level_area.bottom - 1) // height + 1):
+                for column in range(level_area.left // width, (level_area.right - 1) // width + 1):
+                    self.static_layer.blit(self.background, (column*width + offset_x, row*height + offset_y))
+            self.static_layer.blit(self.sun, (offset_x, offset_y))
+
+        tile_size = self.tile_map.tile_size
+        self.tile_map.load_area(area.inflate(tile_size*2, tile_size*2))
+        batch = []
+        for tile in self.tile_map.tile_grid.query(area.inflate(tile_size*2, tile_size*2)): # images can stick out of their rect
+            allignment_x, allignment_y = self.tile_map.image_allignments.get(tile, (0,0))
+            batch.append((tile.image, (tile.rect.x + allignment_x + offset_x, tile.rect.y + allignment_y + offset_y)))
+        self.static_layer.blits(batch, doreturn=False) # one call for the whole layer instead of one per tile
+
+        self.static_layer.set_clip(None)
+
+    def redraw_static(self, area):
+        # for when something draw_static() draws inside the world space rect area has changed
+        if self.static_view is None or not area.colliderect(self.static_view): return
+        self.draw_static(area.clip(self.static_view))
+        self.full_redraw = True
+
+    def update_static(self, view_rect):
+        if self.static_view is None or abs(view_rect.x - self.static_view.x) >= view_rect.width or abs(view_rect.y - self.static_view.y) >= view_rect.height:
+            self.static_view = view_rect.copy()
+            self.draw_static(self.static_view)
+            self.full_redraw = True
+            return
+
+        dx, dy = view_rect.x - self.static_view.x, view_rect.y - self.static_view.y
+        if not (dx or dy): return
 
-        for y,row in enumerate(self.matrix):
-            for x,val in enumerate(row):
-                tile_name = self.legend[val]
-                if tile_name == "player":
-                    object = Player((x * self.tile_size, y * self.tile_size), (self.tile_size, self.tile_size), self.resized_images[tile_name])
-                    self.entities.add(object)
-                    self.player.add(object)
-
-                elif tile_name == "vortex":
-                    object = Vortex((x * self.tile_size, y * self.tile_size), (self.tile_size, self.tile_size), self.resized_images[tile_name], frame_duration = 5)
-                    self.interactables.add(object)
-                    self.image_allignments[object] = (-0.2*self.tile_size, -0.2*self.tile_size)
-
-                elif tile_name == "bomb":
-                    object = Bomb((x * self.tile_size, y * self.tile_size), (self.tile_size, self.tile_size), self.resized_images[tile_name])
-                    self.entities.add(object)
-
-                elif tile_name == "crate" or tile_name == "bomb":
-                    object = Entity((x * self.tile_size, y * self.tile_size), (self.tile_size, self.tile_size), self.resized_images[tile_name])
-                    self.entities.add(object)
-
-                elif tile_name != "air":
-                    if tile_name[:4] == "left":
-                        object = Object((x*self.tile_size + 0.1*self.tile_size, y * self.tile_size), (0.9*self.tile_size, self.tile_size), self.resized_images[tile_name])
-                        self.tiles.add(object)
-                        self.image_allignments[object] = (-0.1*self.tile_size, 0)
-
-                    elif tile_name[:5] == "right":
-                        object = Object((x * self.tile_size, y * self.tile_size), (0.9*self.tile_size, self.tile_size), self.resized_images[tile_name])
-                        self.tiles.add(object)
-
-                    else:
-                        object = Object((x * self.tile_size, y * self.tile_size), (self.tile_size, self.tile_size), self.resized_images[tile_name])
-                        self.tiles.add(object)            
+        # scroll what is already drawn and only draw the strips the camera uncovered
+        self.static_layer.scroll(-dx, -dy)
+        self.static_view = view_rect.copy()
+        if dx > 0: self.draw_static(pygame.Rect(view_rect.right - dx, view_rect.top, dx, view_rect.height))
+        elif dx < 0: self.draw_static(pygame.Rect(view_rect.left, view_rect.top, -dx, view_rect.height))
+        if dy > 0: self.draw_static(pygame.Rect(view_rect.left, view_rect.bottom - dy, view_rect.width, dy))
+        elif dy < 0: self.draw_static(pygame.Rect(view_rect.left, view_rect.top, view_rect.width, -dy))
+        self.full_redraw = True
+
+    def draw(self, surface, view_rect, alpha=1):
+        self.update_static(view_rect)
+
+        # restore what was underneath the moving objects last frame
+        if self.full_redraw: surface.blit(self.static_layer, (0,0))
+        else:
+            for rect in self.dirty_rects: surface.blit(self.static_layer, rect, rect)
+        self.full_redraw = False
+        self.dirty_rects = []
+
+        # only objects inside the view get drawn, all in one blits() call
+        batch = []
+        # entities are drawn in update order, so the ones that pushed last end up on top
+        for group in (self.tile_map.visuals, self.tile_map.interactables, self.tile_map.in_order()):
+            for object in group:
+                x, y = object.rect.topleft
+                if alpha < 1 and object in self.tile_map.previous_positions:
+                    previous_x, previous_y = self.tile_map.previous_positions[object]
+                    x, y = round(previous_x + (x - previous_x)*alpha), round(previous_y + (y - previous_y)*alpha)
+
+                allignment_x, allignment_y = self.tile_map.image_allignments.get(object, (0,0))
+                image_rect = object.image.get_rect(topleft=(x + allignment_x - view_rect.x, y + allignment_y - view_rect.y))
+                if not image_rect.colliderect(surface.get_rect()): continue
+
+                batch.append((object.image, image_rect))
+                self.dirty_rects.append(image_rect)
+
+        surface.blits(batch, doreturn=False)
 
 # GUI classes
+text_cache = {} # rendered lines by (line, font, color, antialias), so screens entered again don't render their text again
+button_cache = {} # finished button images by (size, text, font, color, text color, centered)
+
+def render_text(line, font, color, antialias) -> pygame.Surface:
+    key = (line, font, color, antialias)
+    if key not in text_cache: text_cache[key] = font.render(line, antialias, color)
+    return text_cache[key]
+
 class Text:
     def __init__(self, pos: tuple, text: str, font: pygame.font.Font, color, centered=True, antialias=True):
         self.text = text
         text_lines = text.split('\n')
-        self.surface_list = [font.render(line, antialias, color) for line in text_lines]
+        self.surface_list = [render_text(line, font, color, antialias) for line in text_lines]
         self.rect_list = [surface.get_rect(center=pos) if centered else surface.get_rect(topleft=pos) for surface in self.surface_list]
         y_incr = self.rect_list[0].height
         for i,rect in enumerate(self.rect_list): rect.y += i * y_incr
@@ -450,7 +1693,7 @@ class Text:
         for surf, rect in zip(self.surface_list, self.rect_list): surface.blit(surf, rect)
 
 class Button:
-    def __init__(self, pos: tuple, dimensions: tuple, text, default_color="white", highlight_color="grey", text_color="black", font=button_font, centered=True):
+    def __init__(self, pos: tuple, dimensions: tuple, text, default_color="white", highlight_color="grey", text_color="black", font=None, centered=True):
         self.rect = pygame.Rect(pos, dimensions)
         if centered: self.rect.center = pos
 
@@ -458,27 +1701,185 @@ class Button:
         self.highlight_color = highlight_color
         self.color = default_color
 
-        self.text = Text(pos, text, font, text_color)
+        self.font = font or button_font
+        self.text_color = text_color
+        self.centered = centered
+        self.text = Text(pos, text, self.font, text_color)
     
-    def pressed(self) -> bool:
-        if self.rect.collidepoint(mouse_x, mouse_y):
-            self.color = self.highlight_color
-            if mouse_clicked: 
-                sounds["button_select"].play()
-                return True
-        else:
-            self.color = self.default_color
-
-        return False
+    def image(self) -> pygame.Surface:
+        # the button drawn in its current color, made once and shared by every button that looks the same
+        key = (self.rect.size, self.text.text, self.font, self.color, self.text_color, self.centered)
+        if key not in button_cache:
+            image = pygame.Surface(self.rect.size).convert()
+            image.fill(self.color)
+            pygame.draw.rect(image, "black", image.get_rect(), 2) # outline
+            for surf, rect in zip(self.text.surface_list, self.text.rect_list): image.blit(surf, rect.move(-self.rect.x, -self.rect.y))
+            button_cache[key] = image
+        return button_cache[key]
 
     def draw(self, surface):
-        pygame.draw.rect(surface, self.color, self.rect) # fill
-        pygame.draw.rect(surface, "black", self.rect, 2) # outline
-        self.text.draw(surface)
+        surface.blit(self.image(), self.rect)
+
+class Screen:
+    # a background with texts and buttons on top, only drawn again when a button's highlight changes or after invalidate()
+    def __init__(self, background, texts, buttons):
+        self.background = background
+        self.texts = texts
+        self.buttons = buttons
+        self.drawn = None # color of every button when the screen was last drawn
+
+        self.grid = SpatialGrid(150) # buttons are found by where the mouse is instead of checking every one
+        for button in buttons:
+            button.color = button.default_color
+            self.grid.insert(button)
+        self.hovered = None
+
+    def pressed(self, pos, clicked):
+        # highlights the button under pos, returns it if clicked (otherwise None), only buttons whose highlight changes are touched
+        hits = self.grid.query(pygame.Rect(pos, (1,1)))
+        button = hits[-1] if hits else None
+        if button is not self.hovered:
+            if self.hovered: self.hovered.color = self.hovered.default_color
+            if button: button.color = button.highlight_color
+            self.hovered = button
+
+        if button and clicked:
+            sounds.play("button_select")
+            return button
+
+    def invalidate(self):
+        self.drawn = None
+
+    def draw(self, surface) -> bool:
+        # returns whether surface changed and has to be presented again
+        state = [button.color for button in self.buttons]
+        if state == self.drawn: return False
+
+        surface.blit(self.background, (0,0))
+        for text in self.texts: text.draw(surface)
+        for button in self.buttons: button.draw(surface)
+        self.drawn = state
+        return True
+
+# profiling
+PROFILER_COLORS = ("tomato", "gold", "limegreen", "deepskyblue", "violet", "orange", "turquoise", "pink", "khaki", "lightgrey")
+
+class Profiler:
+    # times the phases of every frame (see mark()) and the methods in methods, while enabled
+    # a graph of the last frames and the average time of every phase are drawn in the corner, and turning it off saves the
+    # recorded frames as a Chrome trace to the profiles folder (open it in chrome://tracing or ui.perfetto.dev)
+    # while disabled the methods aren't wrapped and mark() returns straight away, so it costs next to nothing
+    def __init__(self, methods, history):
+        self.methods = methods # (class, method name) pairs timed inside the phases
+        self.frames = deque(maxlen=history) # (start, duration, phases, calls, totals) of the last finished frames
+        self.colors = {} # graph color of every phase
+        self.enabled = False
+
+    def toggle(self):
+        if self.enabled: self.disable()
+        else: self.enable()
+
+    def enable(self):
+        self.enabled = True
+        self.frames.clear()
+        self.phases = [] # (name, start, duration) of the phases of the current frame
+        self.calls = [] # (name, start, duration, outermost) of the method calls in the current frame
+        self.depth = defaultdict(int) # how many calls of each method are running, calls made inside the same method aren't added to the totals
+        self.frame_start = self.last_mark = perf_counter()
+
+        self.originals = [(cls, name, cls.__dict__[name]) for cls, name in self.methods]
+        for cls, name, method in self.originals: setattr(cls, name, self.timed(method, f"{cls.__name__}.{name}"))
+
+        self.font = pygame.font.Font(f'data/font/{listdir("data/font")[0]}', 28)
+        self.panel = pygame.Surface((600, 660))
+        self.panel.set_alpha(160)
+        self.graph = pygame.Surface((600, 200)).convert() # one bar per frame, the full height is 1/30 of a second
+        self.graph.fill((30,30,30))
+
+    def disable(self):
+        if not self.enabled: return
+        self.enabled = False
+        for cls, name, method in self.originals: setattr(cls, name, method)
+        self.save()
+
+    def timed(self, method, name):
+        def timed(*args, **kwargs):
+            outermost = not self.depth[name]
+            self.depth[name] += 1
+            start = perf_counter()
+            try: return method(*args, **kwargs)
+            finally:
+                self.calls.append((name, start, perf_counter() - start, outermost))
+                self.depth[name] -= 1
+        return timed
+
+    def mark(self, name):
+        # ends the current phase of the frame, everything since the last mark is counted as name
+        if not self.enabled: return
+        now = perf_counter()
+        self.phases.append((name, self.last_mark, now - self.last_mark))
+        self.last_mark = now
+
+    def end_frame(self):
+        if not self.enabled: return
+        now = perf_counter()
+        totals = defaultdict(float)
+        for name, start, duration in self.phases: totals[name] += duration
+        for name, start, duration, outermost in self.calls:
+            if outermost: totals[name] += duration
+        self.frames.append((self.frame_start, now - self.frame_start, self.phases, self.calls, totals))
+
+        # the graph scrolls left and the new frame gets a bar on the right, stacked from its phases in the order they ran
+        width, height = self.graph.get_size()
+        self.graph.scroll(-2, 0)
+        self.graph.fill((30,30,30), (width - 2, 0, 2, height))
+        bottom = height
+        for name, start, duration in self.phases:
+            bar_height = duration * 30 * height
+            self.graph.fill(self.colors.setdefault(name, PROFILER_COLORS[len(self.colors) % len(PROFILER_COLORS)]), (width - 2, round(bottom - bar_height), 2, round(bar_height) or 1))
+            bottom -= bar_height
+
+        self.phases, self.calls = [], []
+        self.frame_start = self.last_mark = now
+
+    def draw(self, surface) -> pygame.Rect:
+        # draws the graph and the average of every phase over the last second in the top right corner, returns where
+        rect = self.panel.get_rect(topright=(surface.get_width() - 20, 20))
+        surface.blit(self.panel, rect)
+        surface.blit(self.graph, rect)
+        graph_width, graph_height = self.graph.get_size()
+        pygame.draw.line(surface, "white", (rect.x, rect.y + graph_height//2), (rect.x + graph_width, rect.y + graph_height//2)) # 1/60 of a second
+
+        recent = list(islice(reversed(self.frames), 60))
+        if not recent: return rect
+        frame_times = [frame[1] for frame in recent]
+        lines = [(f"frame {sum(frame_times) / len(recent) * 1000:.1f} ms, worst {max(frame_times) * 1000:.1f} ms", "white")]
+        for name in dict.fromkeys(name for frame in recent for name in frame[4]):
+            average = sum(frame[4][name] for frame in recent) / len(recent)
+            lines.append((f"{name} {average * 1000:.2f} ms", self.colors.get(name, "white")))
+
+        for i, (line, color) in enumerate(lines[:15]):
+            surface.blit(self.font.render(line, True, color), (rect.x + 10, rect.y + graph_height + 10 + i*30))
+        return rect
+
+    def save(self):
+        if not self.frames: return
+        makedirs("profiles", exist_ok=True)
+        origin = self.frames[0][0]
+        events = []
+        for start, duration, phases, calls, totals in self.frames:
+            events.append({"name": "frame", "ph": "X", "ts": (start - origin) * 1e6, "dur": duration * 1e6, "pid": 0, "tid": 0})
+            for name, start, duration, *_ in phases + calls:
+                events.append({"name": name, "ph": "X", "ts": (start - origin) * 1e6, "dur": duration * 1e6, "pid": 0, "tid": 0})
+
+        path = f"profiles/{strftime('%Y%m%d-%H%M%S')}.json"
+        with open(path, "w") as f: json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        self.frames.clear()
 
 # mode setup
 class Mode:
     def __init__(self, new_mode):
+        self.recorder = None
         self.set_mode(new_mode)
     
     def __repr__(self) -> str:
@@ -487,32 +1888,74 @@ class Mode:
     def __eq__(self, other) -> bool:
         return self._value == other
 
+    def start_recording(self):
+        # every attempt at a level gets its own replay file
+        self.stop_recording()
+        if not RECORD_REPLAYS: return
+
+        seed = random.getrandbits(32)
+        random.seed(seed)
+        self.recorder = InputRecorder(tile_map.level_name, seed)
+
+    def stop_recording(self):
+        if self.recorder is None: return
+        makedirs("replays", exist_ok=True)
+        self.recorder.save(f"replays/{self.recorder.level_name}_{strftime('%Y%m%d-%H%M%S')}_{self.recorder.length}.dtr")
+        self.recorder = None
+
+    def restart_level(self):
+        # much faster than set_mode("play", ...) since the level is restored in place instead of being rebuilt
+        global camera
+        self.start_recording()
+        tile_map.restart()
+        camera = Camera((0,0), window.get_size(), (0.2, 0.3))
+        camera.update(tile_map.player.sprite)
+        renderer.invalidate()
+        scheduler.reset()
+
+    def reload_level(self):
+        # picks up edits to the file of the level being played, see TileMap.reload()
+        # a file that can't be read is left alone, the level carries on as it was until it is saved again
+        try:
+            areas = tile_map.reload()
+            self.recorder = None # the inputs so far were for the level before it was edited
+            if areas is None: self.set_mode("play", level = tile_map.level_name)
+        except (OSError, ValueError, KeyError): return
+
+        for area in areas or (): renderer.redraw_static(area.inflate(2*tile_map.tile_size, 2*tile_map.tile_size)) # tile images stick out of their rects
+
     def set_mode(self, new_mode, level="1-1"):
         self._value = new_mode
+        scheduler.reset() # loading doesn't count as time the physics fell behind
+        self.stop_recording()
 
         if new_mode == "menu":
-            global menu_background, menu_text, play_button, help_button, exit_button
-            menu_background = pygame.transform.scale(images["background2"][0], window.get_size())
+            global menu_background, screen, play_button, help_button, exit_button
+            menu_background = scaled_images("background2", window.get_size())[0]
 
             menu_text = Text((window.get_width()//2, 180), "The Detonator", title_font, "red")
             play_button = Button((960,400), (800,150), "Play")
             help_button = Button((960,650), (800,150), "How To Play")
             exit_button = Button((960,900), (800,150), "Quit Game")
+            screen = Screen(menu_background, [menu_text], [play_button, help_button, exit_button])
 
         elif new_mode == "play":
-            global tile_map, camera, level_text, play_background, sun, pause_surface, paused_text, resume_button, restart_button, levels_button, menu_button
+            global tile_map, camera, renderer, level_text, pause_surface, pause_screen, paused_text, resume_button, restart_button, levels_button, menu_button
             tile_map = TileMap(level)
             camera = Camera((0,0), window.get_size(), (0.2, 0.3))
             camera.update(tile_map.player.sprite)
+            self.start_recording()
 
             level_text = Text((20,20), level, button_font, "black", centered=False)
-            play_background = pygame.transform.scale(images["background1"][0], tile_map.screen.get_size())
+            play_background = scaled_images("background1", window.get_size())[0]
             sun = pygame.Surface((100,100)).convert()
             pygame.Surface.fill(sun,"gold")
+            renderer = Renderer(tile_map, play_background, sun, window.get_size())
             
-            # for pause screen
+            # for pause screen, which is made from the frame the game was paused on (see pause_frame())
             pause_surface = pygame.Surface(window.get_size())
             pause_surface.set_alpha(100)
+            pause_screen = None
 
             paused_text = Text((window.get_width()//2, 180), "Paused", title_font, "white")
             resume_button = Button((960,400), (800,150), "Resume")
@@ -525,8 +1968,9 @@ class Mode:
             page_number = 0
 
             level_selection_text = Text((window.get_width()//2, 180), "Levels", title_font, "black")
-            level_selection_buttons = [Button((450 + 250*(i%5) + 1920*(i//10), 400 + 250*(i//5%2)),(150,150), level_name) for i,level_name in enumerate(level_list)]
+            level_selection_buttons = [Button((450 + 250*(i%5) + 1920*(i//10), 400 + 250*(i//5%2)),(150,150), level_name) for i,level_name in enumerate(levels.names)]
             menu_button = Button((960,900), (800,150), "Menu")
+            screen = Screen(menu_background, [level_selection_text], level_selection_buttons + [menu_button])
 
         elif new_mode == "how_to_play":
             global how_to_play_title, how_to_play_text
@@ -535,123 +1979,155 @@ class Mode:
             with open(f'data/how_to_play.txt','r') as f: how_to_play = f.read()
             how_to_play_text = Text((window.get_width()//2, 300), how_to_play, button_font, "black")
             menu_button = Button((960,900), (800,150), "Menu")
+            screen = Screen(menu_background, [how_to_play_title, how_to_play_text], [menu_button])
 
-mode = Mode("menu")
+    def pause_frame(self):
+        # the level stops being drawn while paused, the pause screen sits on a dimmed copy of its last frame instead
+        global pause_screen
+        frozen_frame = window.copy()
+        frozen_frame.blit(pause_surface, (0,0))
+        pause_screen = Screen(frozen_frame, [paused_text], [resume_button, restart_button, levels_button, menu_button])
+        renderer.invalidate() # the pause screen covers the whole window
 
 def unscaled_pos(pos):
-    return int(pos[0] * window.get_width() / scaled_window.get_width()), int(pos[1] * window.get_height() / scaled_window.get_height())
-
-while True:
-    mouse_x, mouse_y = unscaled_pos(pygame.mouse.get_pos())
-    mouse_clicked = False
-    keys = set() # stores keys pressed on the current frame
+    return scaler.source_pos(pos)
+
+if __name__ == "__main__":
+    sys.stdout = sys.stderr # allows printing to output before script finishes
+    # only what the menu needs is loaded before the first frame, everything else is read in the background
+    setup_window()
+    scaler = OutputScaler(SCALING, window, scaled_window)
+    start_music()
+    assets.muted = False
+    controls = Controls()
+    scheduler = FrameScheduler(PHYSICS_RATE, FPS)
+    profiler = Profiler([(TileMap, "update"), (TileMap, "stream"), (Entity, "movement"), (Bomb, "explode"), (Renderer, "update_static")], 3600)
+    if PROFILE: profiler.enable()
+    mode = Mode("menu")
+    assets.preload()
+
+    while True:
+        mouse_clicked = False
+        redraw = False # whether the window changed and has to be presented
+        keys = set() # stores keys pressed on the current frame
+        events = pygame.event.get()
     
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            pygame.quit()
-            sys.exit()
-
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            mouse_clicked = True
-            # print(f"Mouse: {mouse_x, mouse_y}")
+        for event in events:
+            controls.handle(event)
+            if event.type == pygame.QUIT:
+                mode.stop_recording()
+                profiler.disable()
+                pygame.quit()
+                sys.exit()
+
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                mouse_clicked = True
+                # print(f"Mouse: {controls.screen_pos}")
         
-        elif event.type == pygame.KEYDOWN:
-            keys.add(event.unicode.lower())
-
-        elif event.type == pygame.WINDOWRESIZED:
-            SF = min(scaled_window.get_width() / window.get_width(), scaled_window.get_height() / window.get_height())
+            elif event.type == pygame.KEYDOWN:
+                keys.add(event.unicode.lower())
+                if event.key == pygame.K_F3: profiler.toggle()
+
+            elif event.type == pygame.WINDOWRESIZED:
+                scaler.resize()
+                redraw = True
+        mouse_pos = controls.screen_pos
+        profiler.mark("events")
     
-    if mode == "play":
-        # functionality of objects
-        if not tile_map.paused:
-            tile_map.entities.update()
-            tile_map.interactables.update()
-            tile_map.tiles.update()
-            tile_map.visuals.update()
-        
-        for object, (allignment_x, allignment_y) in tile_map.image_allignments.items(): 
-            object.rect.x += allignment_x
-            object.rect.y += allignment_y
-
-        # drawing of objects
-        tile_map.screen.blit(play_background, (0,0))
-        tile_map.screen.blit(sun, (0,0))
+        if mode == "play":
+            if WATCH_LEVELS and levels.changed(tile_map.level_name): mode.reload_level()
+
+            # functionality of objects
+            view_rect = camera.view_rect
+            if not tile_map.paused:
+                pause_screen = None
+                for _ in range(scheduler.physics_steps()):
+                    previous_view = camera.view_rect.copy()
+                    if INTERPOLATE: tile_map.save_positions()
+
+                    controls.update()
+                    if mode.recorder: mode.recorder.record(controls)
+                    tile_map.update()
+                    if tile_map.player.sprite.level_complete or tile_map.player.sprite.load_new_level: break
+
+                if INTERPOLATE and tile_map.previous_positions:
+                    alpha = scheduler.alpha
+                    view_rect = pygame.Rect(round(previous_view.x + (view_rect.x - previous_view.x)*alpha), round(previous_view.y + (view_rect.y - previous_view.y)*alpha), *view_rect.size)
+            else: scheduler.reset()
+            profiler.mark("physics")
         
-        tile_map.tiles.draw(tile_map.screen)
-        tile_map.visuals.draw(tile_map.screen)
-        tile_map.interactables.draw(tile_map.screen)
-        tile_map.entities.draw(tile_map.screen)
-
-        for object, (allignment_x, allignment_y) in tile_map.image_allignments.items(): 
-            object.rect.x -= allignment_x
-            object.rect.y -= allignment_y
+            # drawing of objects (straight onto the window, in camera space), the pause screen keeps the last frame instead
+            if pause_screen is None:
+                renderer.draw(window, view_rect, scheduler.alpha if INTERPOLATE else 1)
+                redraw = True
         
-        # shows hitboxes of all objects
-        # for group in (tile_map.tiles, tile_map.visuals, tile_map.interactables, tile_map.entities):
-        #     for object in group:
-        #             pygame.draw.rect(tile_map.screen, "red", object.rect, 1)
-
-        # shows hitbox of camera.focus_rect
-        # pygame.draw.rect(tile_map.screen, "red", camera.focus_rect, 1)
-
-        window.blit(tile_map.screen,(-camera.view_rect.x, -camera.view_rect.y))
-        level_text.draw(window)
-
-        if tile_map.player.sprite.load_new_level: mode.set_mode("play", level = tile_map.player.sprite.load_new_level)
-
-        if tile_map.paused:
-            window.blit(pause_surface, (0,0))
-            paused_text.draw(window)
-
-            if resume_button.pressed(): tile_map.paused = not tile_map.paused
-            resume_button.draw(window)
-            
-            if restart_button.pressed(): mode.set_mode("play", tile_map.level_name)
-            restart_button.draw(window)
-
-            if levels_button.pressed(): mode.set_mode("level_selection")
-            levels_button.draw(window)
-
-            if menu_button.pressed(): mode.set_mode("menu")
-            menu_button.draw(window)
+            # shows hitboxes of all objects
+            # for group in (tile_map.tiles, tile_map.visuals, tile_map.interactables, tile_map.entities):
+            #     for object in group:
+            #             pygame.draw.rect(window, "red", object.rect.move(-camera.view_rect.x, -camera.view_rect.y), 1)
+
+            # shows hitbox of camera.focus_rect
+            # pygame.draw.rect(window, "red", camera.focus_rect.move(-camera.view_rect.x, -camera.view_rect.y), 1)
+
+            if pause_screen is None:
+                level_text.draw(window)
+                for rect in level_text.rect_list: renderer.invalidate(rect)
+            profiler.mark("draw")
+
+            if tile_map.player.sprite.level_complete:
+                next_level_idx = levels.names.index(tile_map.level_name) + 1
+                if next_level_idx == len(levels.names): mode.set_mode("level_selection")
+                else: mode.set_mode("play", level = levels.names[next_level_idx])
+
+            elif tile_map.player.sprite.load_new_level == tile_map.level_name: mode.restart_level() # fell into the void
+            elif tile_map.player.sprite.load_new_level: mode.set_mode("play", level = tile_map.player.sprite.load_new_level)
+
+            if tile_map.paused:
+                if pause_screen is None: mode.pause_frame()
+
+                pressed = pause_screen.pressed(mouse_pos, mouse_clicked)
+                if pressed is resume_button: tile_map.paused = not tile_map.paused
+                elif pressed is restart_button: mode.restart_level()
+                elif pressed is levels_button: mode.set_mode("level_selection")
+                elif pressed is menu_button: mode.set_mode("menu")
+                if mode == "play": redraw |= pause_screen.draw(window)
         
-        if 'r' in keys: sounds["button_select"].play(); mode.set_mode("play", tile_map.level_name)
-        if '\x1b' in keys: tile_map.paused = not tile_map.paused
-
-    elif mode == "menu":
-        window.blit(menu_background, (0,0))
-        menu_text.draw(window)
-
-        if play_button.pressed(): mode.set_mode("level_selection")
-        play_button.draw(window)
-
-        if help_button.pressed(): mode.set_mode("how_to_play")
-        help_button.draw(window)
-
-        if exit_button.pressed(): pygame.quit(); sys.exit()
-        exit_button.draw(window)
-
-    elif mode == "level_selection":
-        window.blit(menu_background, (0,0))
-        level_selection_text.draw(window)
-
-        for level_button in level_selection_buttons:
-            if level_button.pressed(): mode.set_mode("play", level = level_button.text.text)
-            level_button.draw(window)
-        
-        if menu_button.pressed(): mode.set_mode("menu")
-        menu_button.draw(window)
-
-    elif mode == "how_to_play":
-        window.blit(menu_background, (0,0))
-        how_to_play_title.draw(window)
-        how_to_play_text.draw(window)
-
-        if menu_button.pressed(): mode.set_mode("menu")
-        menu_button.draw(window)
-        
-    scaled_window.blit(pygame.transform.smoothscale(window, scaled_window.get_size()), (0,0)) # height width ratio is variable
-    # scaled_window.blit(pygame.transform.smoothscale(window, (window.get_width()*SF, window.get_height()*SF)), (0,0)) # height width ratio is constant
-
-    pygame.display.update()
-    clock.tick(FPS) # while True loop wont run faster than 60 times per second
\ No newline at end of file
+            if 'r' in keys: sounds.play("button_select"); mode.restart_level()
+            if '\x1b' in keys: tile_map.paused = not tile_map.paused
+
+        elif mode == "menu":
+            pressed = screen.pressed(mouse_pos, mouse_clicked)
+            if pressed is play_button: mode.set_mode("level_selection")
+            elif pressed is help_button: mode.set_mode("how_to_play")
+            elif pressed is exit_button: profiler.disable(); pygame.quit(); sys.exit()
+
+        elif mode == "level_selection":
+            pressed = screen.pressed(mouse_pos, mouse_clicked)
+            if pressed is menu_button: mode.set_mode("menu")
+            elif pressed: mode.set_mode("play", level = pressed.text.text)
+
+        elif mode == "how_to_play":
+            if screen.pressed(mouse_pos, mouse_clicked) is menu_button: mode.set_mode("menu")
+
+        # menus are only drawn again when a button's highlight changes or a new one was entered
+        if mode != "play": redraw |= screen.draw(window)
+        sounds.flush()
+        profiler.mark("ui")
+
+        if profiler.enabled:
+            # the overlay covers part of the window, so whatever is under it has to be drawn again next frame
+            overlay_rect = profiler.draw(window)
+            if mode != "play": screen.invalidate()
+            elif pause_screen: pause_screen.invalidate()
+            else: renderer.invalidate(overlay_rect)
+            redraw = True
+            profiler.mark("profiler")
+
+        if redraw:
+            scaler.present()
+            profiler.mark("scale")
+            pygame.display.update()
+            profiler.mark("present")
+        scheduler.wait(idle = not redraw and (mode != "play" or tile_map.paused)) # while True loop wont run faster than FPS times per second
+        profiler.mark("wait")
+        profiler.end_frame()
\ No newline at end of file
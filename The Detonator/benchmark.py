@@ -0,0 +1,236 @@
+"""
+Times the update, draw, scale and present phases of the game on generated levels of increasing size.
+
+python benchmark.py                                      default sweep, one JSON line per level size
+python benchmark.py --widths 64,1024 --bombs 200 -o new.json
+python benchmark.py --compare old.json new.json          flags phases that got slower
+python benchmark.py --startup --startup-target 300       time from launch to the menu's first frame
+"""
+
+import os
+import sys
+import json
+import runpy
+import random
+import argparse
+import tempfile
+import subprocess
+from time import perf_counter
+from statistics import mean, median
+from collections import defaultdict
+
+START = perf_counter()
+
+LEGEND = {".": "air", "1": "grass", "2": "dirt", "C": "crate", "B": "bomb", "P": "player", "V": "vortex"}
+
+def make_level(width, height, density, crates, bombs, piles, pile_height, seed):
+    # returns the text of a level in the same format as the files in data/levels
+    rng = random.Random(seed)
+    rows = [["."] * width for _ in range(height)]
+
+    ground = height - 4
+    for x in range(width):
+        rows[ground][x] = "1"
+        for y in range(ground + 1, height): rows[y][x] = "2"
+
+    # solid tiles scattered through the air, density is the fraction of it that gets filled
+    air = [(x, y) for y in range(2, ground - pile_height - 2) for x in range(3, width - 3)]
+    for x, y in rng.sample(air, int(len(air) * density)): rows[y][x] = "2"
+
+    # piles of crates stacked on the ground
+    pile_columns = rng.sample(range(4, width - 4), min(piles, width - 8))
+    for x in pile_columns:
+        for y in range(ground - pile_height, ground): rows[y][x] = "C"
+
+    # loose crates and bombs that fall when the level starts
+    free = [(x, y) for y in range(2, ground) for x in range(3, width - 3) if rows[y][x] == "." and x not in pile_columns]
+    spots = rng.sample(free, min(crates + bombs, len(free)))
+    for i, (x, y) in enumerate(spots): rows[y][x] = "C" if i < crates else "B"
+
+    rows[ground - 1][1] = "P"
+    rows[ground - 1][width - 2] = "V"
+
+    return "\n".join("".join(row) for row in rows) + "\n\n" + "\n".join(f"{key} = {val}" for key, val in LEGEND.items()) + "\n"
+
+def instrument(cls, method_name, phase, totals):
+    # adds the time spent in a method to totals[phase], recursive calls are only counted once
+    original = getattr(cls, method_name)
+    depth = [0]
+
+    def timed(self, *args, **kwargs):
+        if depth[0]: return original(self, *args, **kwargs)
+        depth[0] += 1
+        start = perf_counter()
+        try: return original(self, *args, **kwargs)
+        finally:
+            totals[phase] += perf_counter() - start
+            depth[0] -= 1
+
+    setattr(cls, method_name, timed)
+
+def summary(samples):
+    samples = sorted(samples)
+    return {"mean_ms": mean(samples) * 1000, "median_ms": median(samples) * 1000, "p95_ms": samples[int(len(samples) * 0.95)] * 1000, "total_s": sum(samples)}
+
+def run(game, pygame, level_name, args, detail_totals):
+    results = {}
+
+    start = perf_counter()
+    simulation = game.Simulation(level_name)
+    results["load"] = {"total_s": perf_counter() - start}
+
+    # light a share of the bombs with staggered timers so explosions happen throughout the run
+    rng = random.Random(args.seed)
+    for entity in simulation.tile_map.entities:
+        if isinstance(entity, game.Bomb) and rng.random() < args.ignite:
+            entity.ignited = True
+            entity.frame_duration = 60
+            entity.timer = rng.randint(1, args.frames)
+
+    background = pygame.transform.scale(game.assets.image("background1")[0], game.VIEW_SIZE)
+    sun = pygame.Surface((100,100)).convert()
+    sun.fill("gold")
+    renderer = game.Renderer(simulation.tile_map, background, sun, game.VIEW_SIZE)
+    output = pygame.Surface(args.output_size).convert()
+    scaler = game.OutputScaler(args.scaling, game.window, output)
+
+    samples = defaultdict(list)
+    for _ in range(args.frames):
+        detail_totals.clear()
+
+        start = perf_counter()
+        simulation.step()
+        samples["update"].append(perf_counter() - start)
+        for phase in ("movement", "explode"): samples[phase].append(detail_totals[phase])
+
+        start = perf_counter()
+        renderer.draw(game.window, simulation.camera.view_rect)
+        samples["draw"].append(perf_counter() - start)
+
+        start = perf_counter()
+        scaler.present()
+        samples["scale"].append(perf_counter() - start)
+
+        start = perf_counter()
+        game.scaled_window.blit(output, (0,0))
+        pygame.display.update()
+        samples["present"].append(perf_counter() - start)
+
+    for phase, phase_samples in samples.items():
+        if phase in ("movement", "explode") and not args.detail: continue
+        results[phase] = summary(phase_samples)
+
+    results["entities_left"] = len(simulation.tile_map.entities)
+    return results
+
+def benchmark(args):
+    if not args.window: os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+    import pygame
+    import The_Detonator as game
+    game.setup_window()
+
+    detail_totals = defaultdict(float)
+    if args.detail:
+        instrument(game.Entity, "movement", "movement", detail_totals)
+        instrument(game.Bomb, "explode", "explode", detail_totals)
+
+    level_dir = args.level_dir or tempfile.mkdtemp(prefix="detonator_bench_")
+    os.makedirs(level_dir, exist_ok=True)
+    lines = []
+    for width in args.widths:
+        level_name = f"bench_{width}x{args.height}"
+        file_location = os.path.join(level_dir, level_name + ".txt")
+        with open(file_location, "w") as f:
+            f.write(make_level(width, args.height, args.density, args.crates, args.bombs, args.piles, args.pile_height, args.seed))
+        game.levels.add(level_name, file_location)
+
+        level = {"width": width, "height": args.height, "density": args.density, "crates": args.crates, "bombs": args.bombs,
+                 "piles": args.piles, "pile_height": args.pile_height, "frames": args.frames, "seed": args.seed}
+        line = json.dumps({"level": level, "phases": run(game, pygame, level_name, args, detail_totals)})
+        print(line, flush=True)
+        lines.append(line)
+
+    if args.output:
+        with open(args.output, "w") as f: f.write("\n".join(lines) + "\n")
+
+def startup_child(start):
+    # runs the game until its first frame is presented, then prints how long that took and exits
+    import pygame
+
+    def first_frame(*args):
+        print(json.dumps({"first_frame_ms": (perf_counter() - start) * 1000}), file=sys.__stdout__, flush=True)
+        os._exit(0)
+
+    pygame.display.update = pygame.display.flip = first_frame
+    runpy.run_path("The_Detonator.py", run_name="__main__")
+
+def startup(args):
+    # every launch is a fresh process so nothing is already imported or cached in memory, returns True if the target was missed
+    env = dict(os.environ)
+    if not args.window: env.setdefault("SDL_VIDEODRIVER", "dummy")
+    env.setdefault("SDL_AUDIODRIVER", "dummy")
+
+    samples = []
+    for _ in range(args.repeat):
+        result = subprocess.run([sys.executable, __file__, "--startup-child"], env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout.splitlines()[-1])["first_frame_ms"] / 1000)
+
+    results = summary(samples)
+    results["target_ms"] = args.startup_target
+    print(json.dumps({"startup": results}), flush=True)
+    return results["median_ms"] > args.startup_target
+
+def compare(old_path, new_path, threshold):
+    # prints how every phase changed between two benchmark runs, returns True if any got slower than the threshold
+    def load(path):
+        with open(path) as f: runs = [json.loads(line) for line in f if line.strip()]
+        return {json.dumps(run["level"], sort_keys=True): run for run in runs}
+
+    old, new = load(old_path), load(new_path)
+    regressed = False
+    for key in sorted(old.keys() & new.keys(), key=lambda key: json.loads(key)["width"]):
+        level = new[key]["level"]
+        print(f"{level['width']}x{level['height']}, {level['crates']} crates, {level['bombs']} bombs")
+        for phase, stats in new[key]["phases"].items():
+            if not isinstance(stats, dict) or phase not in old[key]["phases"]: continue
+            metric = "median_ms" if "median_ms" in stats else "total_s"
+            before, after = old[key]["phases"][phase][metric], stats[metric]
+            ratio = after / before if before else 1
+            flag = "  REGRESSION" if ratio > 1 + threshold else ""
+            regressed |= bool(flag)
+            print(f"    {phase:<10}{before:>10.3f} -> {after:<10.3f}{metric:<10} x{ratio:.2f}{flag}")
+
+    return regressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the game on generated levels.")
+    parser.add_argument("--widths", type=lambda s: [int(i) for i in s.split(",")], default=[32, 128, 512, 2048], help="level widths in tiles")
+    parser.add_argument("--height", type=int, default=30, help="level height in tiles")
+    parser.add_argument("--density", type=float, default=0.05, help="fraction of the air filled with solid tiles")
+    parser.add_argument("--crates", type=int, default=40)
+    parser.add_argument("--bombs", type=int, default=20)
+    parser.add_argument("--piles", type=int, default=4, help="number of stacked crate piles")
+    parser.add_argument("--pile-height", type=int, default=6)
+    parser.add_argument("--ignite", type=float, default=0.5, help="fraction of bombs lit at the start")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-size", type=lambda s: tuple(int(i) for i in s.split("x")), default=(800,450), help="size the frame is scaled to")
+    parser.add_argument("--scaling", default="smooth", choices=("smooth", "nearest", "letterbox", "integer"), help="OutputScaler mode used for the scale phase")
+    parser.add_argument("--detail", action="store_true", help="also time Entity.movement and Bomb.explode (adds some overhead)")
+    parser.add_argument("--window", action="store_true", help="use a real window instead of the dummy video driver")
+    parser.add_argument("--level-dir", help="where to write the generated levels")
+    parser.add_argument("-o", "--output", help="also write the results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown counted as a regression by --compare")
+    parser.add_argument("--startup", action="store_true", help="time from launching the game to its first frame instead")
+    parser.add_argument("--startup-target", type=float, default=500, help="median time to first frame in ms that --startup fails above")
+    parser.add_argument("--repeat", type=int, default=5, help="launches timed by --startup")
+    parser.add_argument("--startup-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_child: startup_child(START)
+    if args.compare: sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    if args.startup: sys.exit(1 if startup(args) else 0)
+    benchmark(args)
@@ -0,0 +1,119 @@
+"""
+Plays back replays saved with RECORD_REPLAYS (or made with --generate) through the same physics as the game.
+
+python replay.py replays/1-1.dtr              watch it in real time
+python replay.py --fast replays/*.dtr         fast forward with no window, prints the result of each
+python replay.py --make-golden replays/*.dtr  saves the state hash of every frame next to each replay
+python replay.py --check replays/*.dtr        compares every frame against the saved golden hashes
+python replay.py --generate                   makes a scripted replay for every level in data/levels
+"""
+
+import sys
+import random
+import argparse
+from os import makedirs
+from time import perf_counter
+
+import pygame
+import The_Detonator as game
+
+def fast_forward(path):
+    # returns (status, frames, state hash of every frame)
+    level_name, seed, frames = game.read_replay(path)
+    simulation = game.Simulation(level_name, frames, seed)
+    hashes = []
+    while simulation.frame < len(frames):
+        status = simulation.step()
+        hashes.append(simulation.state_hash())
+        if status != "playing": break
+
+    return simulation.status, simulation.frame, hashes
+
+def watch(path):
+    level_name, seed, frames = game.read_replay(path)
+    game.setup_window()
+    game.assets.muted = False
+
+    simulation = game.Simulation(level_name, frames, seed)
+    background = pygame.transform.scale(game.assets.image("background1")[0], game.VIEW_SIZE)
+    sun = pygame.Surface((100,100)).convert()
+    sun.fill("gold")
+    renderer = game.Renderer(simulation.tile_map, background, sun, game.VIEW_SIZE)
+    scheduler = game.FrameScheduler(game.PHYSICS_RATE, game.FPS)
+    scaler = game.OutputScaler(game.SCALING, game.window, game.scaled_window)
+
+    while simulation.frame < len(frames) and simulation.status == "playing":
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT: return
+            if event.type == pygame.WINDOWRESIZED: scaler.resize()
+
+        for _ in range(scheduler.physics_steps()): simulation.step()
+        game.sounds.flush()
+        renderer.draw(game.window, simulation.camera.view_rect)
+        scaler.present()
+        pygame.display.update()
+        scheduler.wait(idle=False)
+
+    print(f"{path}: {simulation.status} after {simulation.frame} frames")
+
+def golden_path(path):
+    return path + ".golden"
+
+def generate(frame_count):
+    # random but repeatable inputs for every level, walking, jumping and holding the mouse on bombs
+    makedirs("replays", exist_ok=True)
+    for level_name in sorted(game.levels.names):
+        seed = sum(level_name.encode())
+        rng = random.Random(seed)
+        recorder = game.InputRecorder(level_name, seed)
+        bombs = [entity.rect.center for entity in game.Simulation(level_name).tile_map.entities if isinstance(entity, game.Bomb)]
+
+        controls = game.ScriptedControls()
+        for frame in range(frame_count):
+            if frame % 20 == 0:
+                keys = frozenset(rng.sample(game.REPLAY_KEYS, rng.randint(0, 2)))
+                mouse = rng.choice(bombs) if bombs and rng.random() < 0.3 else None
+            controls.keys, controls.mouse_down = keys, mouse is not None
+            if mouse: controls.mouse_pos = mouse
+            recorder.record(controls)
+
+        recorder.save(f"replays/{level_name}.dtr")
+        print(f"replays/{level_name}.dtr")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plays back, fast forwards and checks replays.")
+    parser.add_argument("replays", nargs="*")
+    parser.add_argument("--fast", action="store_true", help="no window, as fast as possible")
+    parser.add_argument("--make-golden", action="store_true", help="save the state hash of every frame")
+    parser.add_argument("--check", action="store_true", help="compare every frame against the golden hashes")
+    parser.add_argument("--generate", action="store_true", help="make a scripted replay for every level")
+    parser.add_argument("--frames", type=int, default=1800, help="length of generated replays")
+    args = parser.parse_args()
+
+    if args.generate: generate(args.frames)
+
+    failed = False
+    for path in args.replays:
+        if not (args.fast or args.make_golden or args.check):
+            watch(path)
+            continue
+
+        start = perf_counter()
+        status, frame_count, hashes = fast_forward(path)
+        elapsed = perf_counter() - start
+
+        if args.make_golden:
+            with open(golden_path(path), "w") as f: f.write("\n".join(hashes) + "\n")
+
+        if args.check:
+            with open(golden_path(path)) as f: golden = f.read().split()
+            mismatch = next((i for i, (a, b) in enumerate(zip(hashes, golden)) if a != b), None)
+            if mismatch is None and len(hashes) != len(golden): mismatch = min(len(hashes), len(golden))
+            if mismatch is not None:
+                failed = True
+                print(f"{path}: differs from golden run at frame {mismatch}")
+                continue
+
+        print(f"{path}: {status} after {frame_count} frames ({elapsed:.3f}s, {frame_count / max(elapsed, 1e-9):.0f} frames/s)")
+
+    sys.exit(1 if failed else 0)
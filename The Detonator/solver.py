@@ -0,0 +1,189 @@
+"""
+Searches for inputs that get the player into the vortex of each level, to check levels can be completed before shipping them.
+
+python solver.py                              every level in data/levels, exits with 1 if any of them wasn't solved
+python solver.py 1-3 2-0 --frames 3600        only these levels, with a longer frame budget
+python solver.py path/to/new_level.txt        a level that isn't in data/levels yet
+python replay.py solutions/1-3.dtr            watch the solution it found
+
+The search is best first over actions, each one holding a set of keys for --hold physics steps or clicking a bomb on
+screen. States with the fewest actions taken plus greed times how far the player is from a vortex go first, a greed of 0
+makes it breadth first so solutions come out as short as the pruning allows, but it takes far longer. States that look
+the same once positions and speeds are rounded to 1/grid of a tile are only explored once, and every state is branched
+from with Simulation.restore() instead of replaying the inputs that led to it.
+
+No one grid and greed solves every level quickly, so each level is searched with every pair in --searches at once, spread
+over a pool of processes, and the first to find a solution stops the others.
+"""
+
+import os
+import sys
+import argparse
+import multiprocessing
+from math import ceil, hypot
+from heapq import heappush, heappop
+from itertools import count
+from time import time, perf_counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pygame
+import The_Detonator as game
+
+KEY_CHOICES = (frozenset(), frozenset({pygame.K_a}), frozenset({pygame.K_d}), frozenset({pygame.K_SPACE}),
+               frozenset({pygame.K_a, pygame.K_SPACE}), frozenset({pygame.K_d, pygame.K_SPACE}))
+TIMER_STEP = 30 # physics steps that bomb timers are rounded to when comparing states
+
+solved = None # a flag for each level, set by the first process to solve it so the others searching it can stop
+
+def add_levels(paths):
+    # for levels given as files, every process needs them added before it can load them
+    for path in paths: game.levels.add(level_name(path), path)
+
+def start_worker(paths, flags):
+    global solved
+    add_levels(paths)
+    solved = flags
+
+def level_name(arg) -> str:
+    return os.path.splitext(os.path.basename(arg))[0] if arg.endswith(".txt") else arg
+
+def actions(simulation) -> list:
+    # (keys held, position clicked in world space or None), only unlit bombs in view can be clicked, like when playing
+    # clicks are only tried standing still, trying them with every set of keys would double the states searched per bomb
+    view_rect = simulation.camera.view_rect
+    clicks = [entity.rect.center for entity in simulation.tile_map.in_order()
+              if isinstance(entity, game.Bomb) and not entity.ignited and view_rect.collidepoint(entity.rect.center)]
+    return [(keys, None) for keys in KEY_CHOICES] + [(frozenset(), click) for click in clicks]
+
+def action_frames(action, hold) -> list:
+    keys, click = action
+    return [(keys, click)] + [(keys, None)] * (hold - 1)
+
+def path_frames(path, hold) -> list:
+    return [frame for action in path for frame in action_frames(action, hold)]
+
+def state_key(simulation, cell) -> tuple:
+    # positions rounded to cells and speeds to cells per step
+    return tuple((entity.rect.x // cell, entity.rect.y // cell, int(entity.dx // cell), int(entity.dy // cell), entity.standing,
+                  getattr(entity, "ignited", None), getattr(entity, "timer", 0) // TIMER_STEP) for entity in simulation.tile_map.in_order())
+
+def unlink(path) -> list:
+    # paths are linked as (last action, path before it) so they share their beginnings
+    actions = []
+    while path:
+        action, path = path
+        actions.append(action)
+    return actions[::-1]
+
+def search(level, grid, greed, args, stop=lambda: False) -> tuple:
+    # best first search from the start of the level, see the top of this file
+    # returns (frames of the first win found or None, whether it stopped before running out of states to search, states seen)
+    simulation = game.Simulation(level)
+    player = simulation.tile_map.player.sprite
+    vortices = [interactable.rect.center for interactable in simulation.tile_map.interactables if isinstance(interactable, game.Vortex)]
+    cell = max(1, simulation.tile_map.tile_size // grid)
+    max_depth = ceil(args.frames / args.hold)
+    walked = player.WALKING_SPEED * args.hold # distance covered by one action of walking
+
+    seen = set()
+    queue = [] # (priority, tie breaker, actions taken, snapshot, path)
+    order = count()
+
+    def push(path, depth):
+        # the simulation has to be at the end of path
+        key = state_key(simulation, cell)
+        if key in seen: return
+        seen.add(key)
+        x, y = player.rect.center
+        distance = min((hypot(x - vortex_x, y - vortex_y) for vortex_x, vortex_y in vortices), default=0)
+        heappush(queue, (depth + greed * distance / walked, next(order), depth, simulation.snapshot(), path))
+
+    push(None, 0)
+    while queue and len(seen) < args.max_states and not stop():
+        _, _, depth, snapshot, path = heappop(queue)
+        if depth >= max_depth: continue
+        simulation.restore(snapshot)
+        for action in actions(simulation):
+            simulation.restore(snapshot)
+            simulation.controls = game.ScriptedControls(action_frames(action, args.hold))
+            status = simulation.step(args.hold)
+            if status == "won": return path_frames(unlink((action, path)), args.hold)[:simulation.frame], True, len(seen)
+            if status == "playing": push((action, path), depth + 1)
+
+    return None, bool(queue), len(seen)
+
+def solve(level, index, grid, greed, args) -> tuple:
+    # runs in the process pool, returns what search() does plus the wall clock times it started and finished at
+    start = time()
+    best, stopped, states = search(level, grid, greed, args, lambda: solved[index])
+    if best: solved[index] = True
+    return best, stopped, states, start, time()
+
+def verify(level, frames) -> bool:
+    # the solution has to win from a fresh start too, not just from restored snapshots
+    simulation = game.Simulation(level, frames)
+    simulation.step(len(frames))
+    return simulation.status == "won"
+
+def save_solution(level, frames, folder) -> str:
+    os.makedirs(folder, exist_ok=True)
+    recorder = game.InputRecorder(level, 0)
+    controls = game.ScriptedControls(frames)
+    for _ in frames:
+        controls.update()
+        recorder.record(controls)
+    path = f"{folder}/{level}.dtr"
+    recorder.save(path)
+    return path
+
+def report(level, parts, args) -> bool:
+    # prints how the search of a level went, returns True if it was solved
+    # the searches of a level run side by side, so the time is from the first one starting to the last one finishing
+    wins = [best for best, _, _, _, _ in parts if best]
+    states = sum(part[2] for part in parts)
+    seconds = max(part[4] for part in parts) - min(part[3] for part in parts)
+    searched = f"{states} states, {seconds:.2f}s"
+
+    if wins:
+        frames = min(wins, key=len)
+        if not verify(level, frames):
+            print(f"{level}: found a solution that doesn't replay from the start ({searched})")
+            return False
+        print(f"{level}: solved in {len(frames)} frames ({searched}) -> {save_solution(level, frames, args.output)}")
+        return True
+
+    if any(stopped for _, stopped, _, _, _ in parts):
+        print(f"{level}: no solution found, stopped at {args.max_states} states per search ({searched})")
+    else:
+        print(f"{level}: unsolvable within {args.frames} frames ({searched})")
+    return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks levels can be completed by searching for a solution.")
+    parser.add_argument("levels", nargs="*", help="level names or .txt files, every level in data/levels if left out")
+    parser.add_argument("--frames", type=int, default=1800, help="most physics steps a solution can take")
+    parser.add_argument("--hold", type=int, default=10, help="physics steps each action lasts")
+    parser.add_argument("--searches", type=lambda s: [(int(grid), float(greed)) for grid, greed in (pair.split(":") for pair in s.split(","))],
+                        default=[(1, 4), (4, 2)], help="grid:greed pairs each level is searched with, 0 greed for the shortest solution")
+    parser.add_argument("--max-states", type=int, default=100000, help="states each search explores before giving up")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes in the pool")
+    parser.add_argument("--output", default="solutions", help="folder the solutions are saved to as replays")
+    args = parser.parse_args()
+
+    paths = [arg for arg in args.levels if arg.endswith(".txt")]
+    add_levels(paths)
+    level_names = [level_name(arg) for arg in args.levels] or sorted(game.levels.names)
+
+    start = perf_counter()
+    passed = []
+    flags = multiprocessing.Array("b", len(level_names), lock=False)
+    with ProcessPoolExecutor(args.workers, initializer=start_worker, initargs=(paths, flags)) as pool:
+        futures = {pool.submit(solve, level, index, grid, greed, args): level for index, level in enumerate(level_names) for grid, greed in args.searches}
+        results = {level: [] for level in level_names}
+        for future in as_completed(futures):
+            level = futures[future]
+            results[level].append(future.result())
+            if len(results[level]) == len(args.searches): passed.append(report(level, results[level], args))
+
+    print(f"{sum(passed)} of {len(passed)} levels solved in {perf_counter() - start:.1f}s with {args.workers} processes")
+    sys.exit(0 if all(passed) else 1)